@@ -0,0 +1,162 @@
+"""Benchmarks for formatting prompts with langchain_contrib.prompts.
+
+Run with `make bench`, or directly with `python benchmarks/bench_prompts.py`. Pass
+a substring to only run the matching benchmarks, e.g.
+
+    python benchmarks/bench_prompts.py choice --seconds 0.5
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+import tracemalloc
+from functools import partial
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from langchain.prompts.base import BasePromptTemplate
+from langchain.tools import Tool
+
+from langchain_contrib.chains.mrkl.prompt import (
+    get_chat_mrkl_prompt,
+    get_string_mrkl_prompt,
+)
+from langchain_contrib.prompts import (
+    ChainedPromptTemplate,
+    ChoicePromptTemplate,
+    ScratchpadPromptValue,
+    ZPromptTemplate,
+)
+
+Benchmark = Tuple[str, Callable[[], object]]
+"""A benchmark name, along with the operation to be timed."""
+
+
+def format_to_string(template: BasePromptTemplate, **kwargs: Any) -> str:
+    """Format the template all the way into a string."""
+    return template.format_prompt(**kwargs).to_string()
+
+
+def format_to_messages(template: BasePromptTemplate, **kwargs: Any) -> object:
+    """Format the template all the way into messages."""
+    return template.format_prompt(**kwargs).to_messages()
+
+
+def format_fresh_choices(template: ChoicePromptTemplate, **kwargs: Any) -> str:
+    """Format after forgetting previous serializations, defeating the cache."""
+    template._serialized.clear()
+    return template.format_prompt(**kwargs).to_string()
+
+
+def zprompt_benchmarks() -> Iterator[Benchmark]:
+    """Format a single ZPromptTemplate with partials."""
+    template = ZPromptTemplate.from_template(
+        "You are {persona}. Answer the question: {question}"
+    ).permissive_partial(persona="a helpful assistant")
+    yield "zprompt", partial(format_to_string, template, question="What is 2 + 2?")
+
+
+def chained_benchmarks() -> Iterator[Benchmark]:
+    """Format ChainedPromptTemplate's with many subprompts."""
+    for n in [10, 100]:
+        template = ChainedPromptTemplate(
+            [f"Section {i}: {{value_{i}}}" for i in range(n)], joiner="\n"
+        )
+        inputs = {f"value_{i}": str(i) for i in range(n)}
+        yield f"chained[{n}]", partial(format_to_string, template, **inputs)
+
+
+def choice_benchmarks() -> Iterator[Benchmark]:
+    """Format ChoicePromptTemplate's with growing numbers of choices."""
+    template = ChoicePromptTemplate.from_template("Pick one of {choices} for {input}")
+    for n in [10, 100, 1000]:
+        choices = [f"choice number {i}" for i in range(n)]
+        yield f"choice[{n}]", partial(
+            format_to_string, template, choices=choices, input="anything"
+        )
+        yield f"choice[{n}]-uncached", partial(
+            format_fresh_choices, template, choices=choices, input="anything"
+        )
+
+
+def mrkl_benchmarks() -> Iterator[Benchmark]:
+    """Format MRKL prompts with growing scratchpads, as in an agent loop."""
+    tools = [
+        Tool(name=f"Tool{i}", func=str, description=f"Does thing number {i}.")
+        for i in range(10)
+    ]
+    for variant, template in [
+        ("string", get_string_mrkl_prompt().permissive_partial(tools=tools)),
+        ("chat", get_chat_mrkl_prompt().permissive_partial(tools=tools)),
+    ]:
+        for steps in [1, 10, 50]:
+            scratchpad = ScratchpadPromptValue()
+            for i in range(steps):
+                scratchpad = scratchpad.append(
+                    f" Step {i}.\nAction: Tool1\nAction Input: x\nObservation: y\n"
+                    "Thought:"
+                )
+            yield f"mrkl-{variant}[{steps} steps]", partial(
+                format_to_messages,
+                template,
+                input="What is MRKL?",
+                agent_scratchpad=scratchpad,
+            )
+
+
+ALL_BENCHMARKS = [
+    zprompt_benchmarks,
+    chained_benchmarks,
+    choice_benchmarks,
+    mrkl_benchmarks,
+]
+
+
+def ops_per_second(operation: Callable[[], object], seconds: float) -> float:
+    """Run the operation repeatedly for about the given number of seconds."""
+    operation()  # warm up caches, as they would be in a long-running process
+    count = 0
+    batch = 1
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < seconds:
+        for _ in range(batch):
+            operation()
+        count += batch
+        batch *= 2
+        elapsed = time.perf_counter() - start
+    return count / elapsed
+
+
+def peak_memory(operation: Callable[[], object]) -> int:
+    """Return the peak number of bytes allocated during one run of the operation."""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        operation()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run all benchmarks that match the filter and print a table of results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("filter", nargs="?", default="", help="Only run these")
+    parser.add_argument(
+        "--seconds", type=float, default=1.0, help="Time to spend per benchmark"
+    )
+    args = parser.parse_args(argv)
+
+    print(f"{'benchmark':<32} {'ops/sec':>12} {'peak KiB':>10}")
+    for group in ALL_BENCHMARKS:
+        for name, operation in group():
+            if args.filter not in name:
+                continue
+            rate = ops_per_second(operation, args.seconds)
+            peak = peak_memory(operation) / 1024
+            print(f"{name:<32} {rate:>12,.0f} {peak:>10,.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,125 @@
 """Chain that chooses and performs the next action."""
 from __future__ import annotations
 
+import asyncio
 import json
-from typing import Any, Callable, Dict, List, Mapping, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
-from langchain.callbacks.manager import CallbackManagerForChainRun
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
 from langchain.chains.base import Chain
+from langchain.chains.llm import LLMChain
 from langchain.input import get_color_mapping
 from langchain.tools.base import BaseTool
-
-from langchain_contrib.utils import safe_inputs
+from pydantic import PrivateAttr
 
 from .tool import ToolChain
 
+T = TypeVar("T")
+
+
+def _is_sync_only(chain: Chain) -> bool:
+    """Whether the chain lacks its own async implementation."""
+    return type(chain)._acall is Chain._acall
+
+
+async def _acall_chain(chain: Chain, inputs: Dict[str, str]) -> Dict[str, str]:
+    """Await the chain, running it in a worker thread if it's sync-only."""
+    if _is_sync_only(chain):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, partial(chain, inputs, return_only_outputs=True)
+        )
+    return await chain.acall(inputs, return_only_outputs=True)
+
+
+def _batches_generations(chain: Chain) -> bool:
+    """Whether the chain's apply sends all of its inputs to one LLM generate call.
+
+    Subclasses that override _call or use memory would get skipped over by
+    LLMChain.apply, so those get called one input at a time instead.
+    """
+    return (
+        isinstance(chain, LLMChain)
+        and type(chain)._call is LLMChain._call
+        and chain.memory is None
+    )
+
+
+def _apply_chain(
+    chain: Chain, input_list: List[Dict[str, str]]
+) -> List[Dict[str, str]]:
+    """Run the chain on all inputs, batching them together if possible."""
+    if _batches_generations(chain):
+        return chain.apply(input_list)
+    return [chain(inputs, return_only_outputs=True) for inputs in input_list]
+
+
+async def _aapply_chain(
+    chain: Chain, input_list: List[Dict[str, str]]
+) -> List[Dict[str, str]]:
+    """Await the chain on all inputs, batching them together if possible."""
+    if _batches_generations(chain):
+        assert isinstance(chain, LLMChain)
+        return await chain.aapply(input_list)
+    return [await _acall_chain(chain, inputs) for inputs in input_list]
+
+
+async def _limited(semaphore: Optional[asyncio.Semaphore], task: Awaitable[T]) -> T:
+    """Await the task once the semaphore lets it through, if there is one."""
+    if semaphore is None:
+        return await task
+    async with semaphore:
+        return await task
+
+
+_PLAN_FIELDS = frozenset(
+    ["choice_picker", "choices", "ignore_keys", "chain_inputs_key", "chain_outputs_key"]
+)
+"""The ChoiceChain fields that its routing plan is built from."""
+
+
+class _RoutingPlan(NamedTuple):
+    """Key sets that a ChoiceChain needs on every call, computed ahead of time."""
+
+    ignore_keys: FrozenSet[str]
+    """Picker output keys that don't get passed on to the chosen chain."""
+    choices: Dict[str, Tuple[Chain, FrozenSet[str]]]
+    """The chain of each choice, along with its input keys."""
+    output_keys: Tuple[str, ...]
+    """All keys that the ChoiceChain could possibly output."""
+
+
+class _Route(NamedTuple):
+    """Where a ChoiceChain decided to send its inputs."""
+
+    choice: str
+    """The choice that was picked."""
+    chain: Chain
+    """The chain corresponding to the choice."""
+    ignored_output: Dict[str, str]
+    """Picker output that is returned but not passed on to the chosen chain."""
+    picker_output: Dict[str, str]
+    """Prepped picker output, without the choice itself."""
+    chain_inputs: Dict[str, str]
+    """The inputs to pass to the chosen chain."""
+
 
 class ChoiceChain(Chain):
     """Chain that asks the LLM for a decision and executes it."""
@@ -44,6 +151,59 @@ class ChoiceChain(Chain):
     chain_outputs_key: str = "choice_outputs"
     """Key for chosen chain outputs."""
 
+    _plan: Optional[_RoutingPlan] = PrivateAttr(default=None)
+    """Precomputed key sets for routing, built from the fields above."""
+
+    def __init__(self, **kwargs: Any):
+        """Initialize the chain and precompute its routing plan."""
+        super().__init__(**kwargs)
+        self._get_plan()
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        """Set the field, dropping the routing plan if it was built from that field."""
+        super().__setattr__(name, value)
+        if name in _PLAN_FIELDS:
+            self._plan = None
+
+    def copy(self, **kwargs: Any) -> ChoiceChain:
+        """Copy the chain, leaving the routing plan to be built for the copy.
+
+        The plan may not apply to the copy, such as when the choices get updated.
+        """
+        result = super().copy(**kwargs)
+        result._init_private_attributes()
+        return result
+
+    def _get_plan(self) -> _RoutingPlan:
+        """Get the routing plan, creating it if necessary.
+
+        Replacing the fields that the plan is built from drops the plan. Choices that
+        get added or removed in place are noticed by their count, and a chain that
+        gets replaced in place under an existing choice is noticed once that choice
+        gets picked. Other in-place changes, such as to ignore_keys, require the
+        field to be assigned again.
+        """
+        plan = self._plan
+        if plan is None or len(plan.choices) != len(self.choices):
+            plan = self._build_plan()
+        return plan
+
+    def _build_plan(self) -> _RoutingPlan:
+        """Build the routing plan from the current fields."""
+        all_keys = {self.chain_inputs_key, self.chain_outputs_key}
+        all_keys.update(self.choice_picker.output_keys)
+        for choice in self.choices.values():
+            all_keys.update(choice.output_keys)
+        self._plan = _RoutingPlan(
+            ignore_keys=frozenset(self.ignore_keys),
+            choices={
+                name: (chain, frozenset(chain.input_keys))
+                for name, chain in self.choices.items()
+            },
+            output_keys=tuple(all_keys),
+        )
+        return self._plan
+
     @classmethod
     def from_tools(
         cls,
@@ -84,11 +244,7 @@ class ChoiceChain(Chain):
     @property
     def output_keys(self) -> List[str]:
         """Possible output keys produced by this chain."""
-        all_keys = {self.chain_inputs_key, self.chain_outputs_key}
-        all_keys.update(self.choice_picker.output_keys)
-        for choice in self.choices.values():
-            all_keys.update(choice.output_keys)
-        return list(all_keys)
+        return list(self._get_plan().output_keys)
 
     def _validate_outputs(self, outputs: Dict[str, str]) -> None:
         """Skip validation because different options may produce different outputs.
@@ -96,22 +252,20 @@ class ChoiceChain(Chain):
         It is assumed that each individual choice chain will validate its own output.
         """
 
-    def _call(
-        self,
-        inputs: Dict[str, str],
-        run_manager: Optional[CallbackManagerForChainRun] = None,
-    ) -> Dict[str, str]:
-        """Run the logic of this chain and return the output."""
-        # Get picker output
-        raw_picker_output = self.choice_picker(inputs, return_only_outputs=True)
+    def _route(
+        self, inputs: Dict[str, str], raw_picker_output: Dict[str, str]
+    ) -> _Route:
+        """Figure out which chain to run, and with what inputs."""
         if self.choice_key not in raw_picker_output:
             raise KeyError(f"Choice-picking chain did not emit '{self.choice_key}'")
-        ignored_output = {
-            k: v for k, v in raw_picker_output.items() if k in self.ignore_keys
-        }
-        real_raw_output = {
-            k: v for k, v in raw_picker_output.items() if k not in self.ignore_keys
-        }
+        plan = self._get_plan()
+        ignored_output: Dict[str, str] = {}
+        real_raw_output: Dict[str, str] = {}
+        for k, v in raw_picker_output.items():
+            if k in plan.ignore_keys:
+                ignored_output[k] = v
+            else:
+                real_raw_output[k] = v
         picker_output = self.prep_picker_output(real_raw_output)
         if self.choice_key not in picker_output:
             raise KeyError(f"Picker output prepper did not emit '{self.choice_key}'")
@@ -122,27 +276,198 @@ class ChoiceChain(Chain):
         if choice not in self.choices:
             raise KeyError(f"Choice picked does not exist: '{choice}'")
         chosen_chain = self.choices[choice]
+        planned_chain, allowed_keys = plan.choices.get(choice, (None, frozenset()))
+        if planned_chain is not chosen_chain:
+            # the choice was replaced in place since the plan got built
+            plan = self._build_plan()
+            allowed_keys = plan.choices[choice][1]
 
         # Massage picker output into chosen chain inputs
-        unused_args = picker_output.keys() - chosen_chain.input_keys
+        unused_args = picker_output.keys() - allowed_keys
         if unused_args:
             raise KeyError(f"Extra input keys for choice: {unused_args}")
-        full_inputs = {**inputs, **picker_output}
-        chain_inputs = safe_inputs(chosen_chain, full_inputs)
+        chain_inputs = {k: v for k, v in inputs.items() if k in allowed_keys}
+        chain_inputs.update(picker_output)
+        return _Route(
+            choice=choice,
+            chain=chosen_chain,
+            ignored_output=ignored_output,
+            picker_output=picker_output,
+            chain_inputs=chain_inputs,
+        )
 
-        # Return chosen chain outputs
-        chain_outputs = chosen_chain(chain_inputs, return_only_outputs=True)
+    def _finish(self, route: _Route, chain_outputs: Dict[str, str]) -> Dict[str, str]:
+        """Combine the routing decision with the chosen chain's outputs."""
         result = {
-            self.choice_key: choice,
-            **ignored_output,
-            **picker_output,
+            self.choice_key: route.choice,
+            **route.ignored_output,
+            **route.picker_output,
             **chain_outputs,
         }
         if self.emit_io_info:
-            result[self.chain_inputs_key] = json.dumps(chain_inputs)
+            result[self.chain_inputs_key] = json.dumps(route.chain_inputs)
             result[self.chain_outputs_key] = json.dumps(chain_outputs)
         return result
 
+    def _call(
+        self,
+        inputs: Dict[str, str],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Dict[str, str]:
+        """Run the logic of this chain and return the output."""
+        raw_picker_output = self.choice_picker(inputs, return_only_outputs=True)
+        route = self._route(inputs, raw_picker_output)
+        chain_outputs = route.chain(route.chain_inputs, return_only_outputs=True)
+        return self._finish(route, chain_outputs)
+
+    async def _acall(
+        self,
+        inputs: Dict[str, str],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, str]:
+        """Run the logic of this chain asynchronously and return the output.
+
+        Chains without async support get run in the event loop's default executor,
+        so that they don't block other routing decisions in the meantime.
+        """
+        raw_picker_output = await _acall_chain(self.choice_picker, inputs)
+        route = self._route(inputs, raw_picker_output)
+        chain_outputs = await _acall_chain(route.chain, route.chain_inputs)
+        return self._finish(route, chain_outputs)
+
+    def _batch_groups(self, routes: List[_Route]) -> List[List[int]]:
+        """Group the indices of routes that can be run together.
+
+        Routes going to the same chain that batches generations form one group.
+        Every other route gets its own group.
+        """
+        by_choice: Dict[str, List[int]] = {}
+        for i, route in enumerate(routes):
+            by_choice.setdefault(route.choice, []).append(i)
+        groups: List[List[int]] = []
+        for choice, indices in by_choice.items():
+            if _batches_generations(self.choices[choice]):
+                groups.append(indices)
+            else:
+                groups.extend([i] for i in indices)
+        return groups
+
+    def batch(
+        self,
+        inputs: List[Dict[str, Any]],
+        max_concurrency: Optional[int] = None,
+        return_only_outputs: bool = False,
+    ) -> List[Dict[str, str]]:
+        """Run this chain on many independent inputs at once.
+
+        The picker runs on all inputs first. An LLMChain picker gets all inputs in
+        one `generate` call. Inputs are then grouped by their chosen chain, and the
+        groups run concurrently in a thread pool. Callbacks only fire for the
+        sub-chains, not for this chain itself.
+
+        Args:
+            inputs: The inputs to run the chain on.
+            max_concurrency: The maximum number of threads running chains at once.
+                Defaults to the ThreadPoolExecutor default.
+            return_only_outputs: Whether to leave out the inputs from each result,
+                as with `__call__`.
+
+        Returns:
+            The results of each input, in the same order as the inputs.
+        """
+        prepped = [self.prep_inputs(i) for i in inputs]
+        if not prepped:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            if _batches_generations(self.choice_picker):
+                picker_outputs = self.choice_picker.apply(prepped)
+            else:
+                pick = partial(self.choice_picker, return_only_outputs=True)
+                picker_outputs = list(executor.map(pick, prepped))
+            routes = [self._route(i, o) for i, o in zip(prepped, picker_outputs)]
+            futures = [
+                (
+                    group,
+                    executor.submit(
+                        _apply_chain,
+                        routes[group[0]].chain,
+                        [routes[i].chain_inputs for i in group],
+                    ),
+                )
+                for group in self._batch_groups(routes)
+            ]
+            results: List[Dict[str, str]] = [{} for _ in prepped]
+            for group, future in futures:
+                for i, chain_outputs in zip(group, future.result()):
+                    results[i] = self.prep_outputs(
+                        prepped[i],
+                        self._finish(routes[i], chain_outputs),
+                        return_only_outputs,
+                    )
+        return results
+
+    async def abatch(
+        self,
+        inputs: List[Dict[str, Any]],
+        max_concurrency: Optional[int] = None,
+        return_only_outputs: bool = False,
+    ) -> List[Dict[str, str]]:
+        """Run this chain on many independent inputs at once, asynchronously.
+
+        This works like `batch`, except that groups run as concurrent tasks on the
+        event loop. Sync-only chains still get offloaded to the default executor.
+
+        Args:
+            inputs: The inputs to run the chain on.
+            max_concurrency: The maximum number of groups running at once. Unlimited
+                by default.
+            return_only_outputs: Whether to leave out the inputs from each result,
+                as with `acall`.
+
+        Returns:
+            The results of each input, in the same order as the inputs.
+        """
+        prepped = [self.prep_inputs(i) for i in inputs]
+        if not prepped:
+            return []
+
+        semaphore = (
+            None if max_concurrency is None else asyncio.Semaphore(max_concurrency)
+        )
+        if _batches_generations(self.choice_picker):
+            picker_outputs = await _aapply_chain(self.choice_picker, prepped)
+        else:
+            picker_outputs = await asyncio.gather(
+                *(
+                    _limited(semaphore, _acall_chain(self.choice_picker, i))
+                    for i in prepped
+                )
+            )
+        routes = [self._route(i, o) for i, o in zip(prepped, picker_outputs)]
+        groups = self._batch_groups(routes)
+        group_outputs = await asyncio.gather(
+            *(
+                _limited(
+                    semaphore,
+                    _aapply_chain(
+                        routes[group[0]].chain,
+                        [routes[i].chain_inputs for i in group],
+                    ),
+                )
+                for group in groups
+            )
+        )
+        results: List[Dict[str, str]] = [{} for _ in prepped]
+        for group, outputs in zip(groups, group_outputs):
+            for i, chain_outputs in zip(group, outputs):
+                results[i] = self.prep_outputs(
+                    prepped[i],
+                    self._finish(routes[i], chain_outputs),
+                    return_only_outputs,
+                )
+        return results
+
     def chosen_inputs(self, outputs: Dict[str, str]) -> Dict[str, str]:
         """Extract the inputs to the chosen chain from ChoiceChain output."""
         return json.loads(outputs[self.chain_inputs_key])
@@ -1,7 +1,7 @@
 """Prompting configuration for MRKL agents."""
 from __future__ import annotations
 
-from typing import Any, Sequence, Union
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 from fvalues import F
 from langchain.base_language import BaseLanguageModel
@@ -13,17 +13,46 @@ from langchain.prompts.chat import (
     SystemMessagePromptTemplate,
 )
 from langchain.schema import BaseMessage, PromptValue
-from pydantic import Extra
+from langchain.tools.base import BaseTool
+from pydantic import Extra, Field
 
 from langchain_contrib.prompts import (
     ChainedPromptValue,
+    ChatDeltaPromptValue,
+    ChatSession,
     ChoicePromptTemplate,
     DefaultsTo,
+    ScratchpadPromptValue,
     ZBasePromptTemplate,
     ZChatPromptTemplate,
     ZPromptTemplate,
+    aformat_prompt,
+    format_prompts,
+    register_class,
+    register_function,
 )
-from langchain_contrib.prompts.choice import get_simple_joiner
+from langchain_contrib.prompts.budget import (
+    TokenBudgetReport,
+    TokenCounter,
+    estimate_tokens,
+    fit_steps,
+)
+from langchain_contrib.prompts.choice import (
+    BaseChoicePrompt,
+    BM25ChoiceRetriever,
+    get_simple_joiner,
+)
+from langchain_contrib.utils import profiled
+
+
+def tool_name(tool: BaseTool) -> str:
+    """Describe a tool by its name alone."""
+    return tool.name
+
+
+def tool_description(tool: BaseTool) -> str:
+    """Describe a tool by its name and description."""
+    return F(f"{tool.name}: {tool.description}")
 
 
 class MrklPromptTemplate(ZBasePromptTemplate):
@@ -34,6 +63,20 @@ class MrklPromptTemplate(ZBasePromptTemplate):
     - putting the scratchpad as a regular string in a string template
     - putting the scratchpad as a regular string in a message in a chat template
     - putting the scratchpad as a chat in a chat template
+
+    The scratchpad can be passed in as a plain string, or as a
+    ScratchpadPromptValue that gets extended by one step every agent iteration.
+
+    When the scratchpad is appended, the resulting ChainedPromptValue marks the rest
+    of the prompt as its static prefix. When it's embedded at the end of the template,
+    as in the default templates, the choice prompt marks the scratchpad as its dynamic
+    suffix instead, so that everything before it makes up the static prefix. The prefix
+    then stays byte-for-byte the same across agent iterations, which lets backends
+    reuse their prompt caches.
+
+    If a token budget is set, the oldest scratchpad steps get elided whenever the
+    prompt would otherwise go over budget. Plain string scratchpads count as a single
+    step.
     """
 
     base_template: BasePromptTemplate
@@ -44,6 +87,24 @@ class MrklPromptTemplate(ZBasePromptTemplate):
     """
     scratchpad_key: str = "agent_scratchpad"
     """Which key will be used for agent scratchpad formatting."""
+    scratchpad_joiner: str = "\n\n"
+    """How an appended scratchpad gets joined to the rest of the prompt.
+
+    Unused if the scratchpad is embedded in the base template.
+    """
+    token_budget: Optional[int] = None
+    """If set, the maximum number of tokens that the formatted prompt may use."""
+    token_counter: TokenCounter = Field(default=estimate_tokens)
+    """How to count the tokens in a prompt.
+
+    Defaults to a rough character-based estimate. Pass in a real tokenizer such as
+    `llm.get_num_tokens` for exact counts.
+    """
+    max_step_tokens: Optional[int] = None
+    """If set, long scratchpad steps get truncated to this many tokens when over
+    budget, before any steps get dropped entirely."""
+    elision_note: str = " ({count} earlier steps omitted)\n"
+    """What to put in place of the scratchpad steps that were dropped."""
 
     class Config:
         """Configuration for this pydantic object."""
@@ -55,6 +116,9 @@ class MrklPromptTemplate(ZBasePromptTemplate):
         cls,
         base_template: BasePromptTemplate,
         scratchpad_key: str = "agent_scratchpad",
+        tool_retriever: Optional[BM25ChoiceRetriever] = None,
+        token_budget: Optional[int] = None,
+        token_counter: TokenCounter = estimate_tokens,
         **kwargs: Any,
     ) -> MrklPromptTemplate:
         """Load a MRKL prompt template from a base template.
@@ -62,18 +126,33 @@ class MrklPromptTemplate(ZBasePromptTemplate):
         Input variables must at least include {tools}, {tool_descriptions}, and
         {input}. {agent_scratchpad} is optional in the template declaration, but must
         still be passed in at prompt formatting time.
+
+        If a tool retriever is given, only the tools most relevant to {input} will be
+        shown to the LLM. Both the tool names and the tool descriptions will then be
+        drawn from the same shortlist. Retrievers left with the default `str`
+        document serializer search over the tool descriptions instead.
+
+        If a token budget is given, the oldest scratchpad steps get elided to keep
+        the prompt within that many tokens, as counted by the token counter.
         """
+        if tool_retriever is not None and tool_retriever.document_serializer is str:
+            # str would index the repr of each tool, not what the LLM gets to see
+            tool_retriever = tool_retriever.copy(
+                update={"document_serializer": tool_description}
+            )
         tool_names_template = ChoicePromptTemplate.from_base_template(
             base_template=base_template,
             choice_format_key="tools",
-            choice_serializer=lambda tool: tool.name,
+            choice_serializer=tool_name,
             choices_formatter=get_simple_joiner(),
+            choice_retriever=tool_retriever,
         )
         tool_descriptions_template = ChoicePromptTemplate.from_base_template(
             base_template=tool_names_template,
             choice_format_key="tool_descriptions",
-            choice_serializer=lambda tool: F(f"{tool.name}: {tool.description}"),
+            choice_serializer=tool_description,
             choices_formatter=get_simple_joiner("\n"),
+            choice_retriever=tool_retriever,
         )
         input_variables = base_template.input_variables.copy()
 
@@ -83,7 +162,10 @@ class MrklPromptTemplate(ZBasePromptTemplate):
         final_partial = (
             super()
             .from_base_template(
-                tool_descriptions_template, input_variables=input_variables
+                tool_descriptions_template,
+                input_variables=input_variables,
+                token_budget=token_budget,
+                token_counter=token_counter,
             )
             .permissive_partial(tool_descriptions=DefaultsTo("tools"), **kwargs)
         )
@@ -122,7 +204,7 @@ class MrklPromptTemplate(ZBasePromptTemplate):
     def _scratchpad_as_prompt_value(self, agent_scratchpad: Any) -> PromptValue:
         """Ensure that the agent scratchpad becomes a PromptValue."""
         if isinstance(agent_scratchpad, str):
-            return StringPromptValue(text=agent_scratchpad)
+            return StringPromptValue.construct(text=agent_scratchpad)
         elif isinstance(agent_scratchpad, PromptValue):
             return agent_scratchpad
         else:
@@ -132,24 +214,171 @@ class MrklPromptTemplate(ZBasePromptTemplate):
     def _prompt_type(self) -> str:
         return "mrkl"
 
+    @profiled()
+    def format_prompt(self, **kwargs: Any) -> PromptValue:
+        """Format the prompt, appending the scratchpad if needed."""
+        return self._format_prompt(**self._merge_partial_and_user_variables(**kwargs))
+
     def _format_prompt(self, **kwargs: Any) -> PromptValue:
         """Format the prompt with the given inputs."""
-        assert (
-            self.scratchpad_key in kwargs
-        ), "Agent scratchpad must still be provided as input key"
-        scratchpad = kwargs.pop(self.scratchpad_key)
-        if self.scratchpad_key in self.base_template.input_variables:
-            kwargs[self.scratchpad_key] = self._scratchpad_as_str(scratchpad)
-            return self.base_template.format_prompt(**kwargs)
+        return self._format_merged_prompts([kwargs])[0]
+
+    def format_chat_delta(
+        self, session: ChatSession, **kwargs: Any
+    ) -> ChatDeltaPromptValue:
+        """Format the prompt and record it as the next prompt of a chat session.
+
+        Messages repeated from the session's previous prompt are reused as-is, and
+        `new_messages` of the result only contains what was added since then.
+        """
+        return session.delta(self.format_prompt(**kwargs))
+
+    def budgeted_format_prompt(
+        self, **kwargs: Any
+    ) -> Tuple[PromptValue, TokenBudgetReport]:
+        """Format the prompt within the token budget, and report what was dropped."""
+        return self._fit_to_budget(self._merge_partial_and_user_variables(**kwargs))
+
+    async def abudgeted_format_prompt(
+        self, **kwargs: Any
+    ) -> Tuple[PromptValue, TokenBudgetReport]:
+        """Format the prompt within the token budget, allowing for async partials."""
+        merged = await self._get_partials_plan().aresolve(kwargs)
+        return await self._afit_to_budget(merged)
+
+    def _fit_to_budget(
+        self, kwargs: Dict[str, Any]
+    ) -> Tuple[PromptValue, TokenBudgetReport]:
+        """Format the prompt, eliding scratchpad steps until it fits the budget."""
+        value = self._format_unbudgeted([dict(kwargs)])[0]
+        tokens = self.token_counter(value.to_string())
+        report = self._elide_steps(kwargs, tokens)
+        if report is None:
+            return value, TokenBudgetReport(budget=self.token_budget, tokens=tokens)
+        value = self._format_unbudgeted([kwargs])[0]
+        report.tokens = self.token_counter(value.to_string())
+        return value, report
+
+    async def _afit_to_budget(
+        self, kwargs: Dict[str, Any]
+    ) -> Tuple[PromptValue, TokenBudgetReport]:
+        """Format the prompt asynchronously, eliding steps to fit the budget."""
+        value = await self._aformat_unbudgeted(dict(kwargs))
+        tokens = self.token_counter(value.to_string())
+        report = self._elide_steps(kwargs, tokens)
+        if report is None:
+            return value, TokenBudgetReport(budget=self.token_budget, tokens=tokens)
+        value = await self._aformat_unbudgeted(kwargs)
+        report.tokens = self.token_counter(value.to_string())
+        return value, report
+
+    def _elide_steps(
+        self, kwargs: Dict[str, Any], tokens: int
+    ) -> Optional[TokenBudgetReport]:
+        """Put a scratchpad that fits the budget into the inputs, if it doesn't yet.
+
+        The token count of the full prompt is used to tell how many tokens the rest
+        of the prompt takes up. Returns None if the prompt already fits.
+        """
+        if self.token_budget is None or tokens <= self.token_budget:
+            return None
+
+        scratchpad = kwargs[self.scratchpad_key]
+        if isinstance(scratchpad, ScratchpadPromptValue):
+            steps = scratchpad.steps
+        else:
+            steps = [self._scratchpad_as_str(scratchpad)]
+        scratchpad_tokens = self.token_counter(self._scratchpad_as_str(scratchpad))
+        kept, report = fit_steps(
+            steps,
+            budget=self.token_budget - (tokens - scratchpad_tokens),
+            token_counter=self.token_counter,
+            max_step_tokens=self.max_step_tokens,
+            elision_note=self.elision_note,
+        )
+
+        if isinstance(scratchpad, ScratchpadPromptValue):
+            kwargs[self.scratchpad_key] = ScratchpadPromptValue(
+                joiner=scratchpad.joiner, steps=kept
+            )
         else:
-            return ChainedPromptValue(
-                joiner="\n\n",
-                subvalues=[
-                    self.base_template.format_prompt(**kwargs),
-                    self._scratchpad_as_prompt_value(scratchpad),
-                ],
+            kwargs[self.scratchpad_key] = "".join(kept)
+        report.budget = self.token_budget
+        return report
+
+    def _format_merged_prompts(self, inputs: List[Dict[str, Any]]) -> List[PromptValue]:
+        """Format the prompt for a batch of inputs."""
+        if self.token_budget is not None:
+            return [self._fit_to_budget(kwargs)[0] for kwargs in inputs]
+        return self._format_unbudgeted(inputs)
+
+    def _format_unbudgeted(self, inputs: List[Dict[str, Any]]) -> List[PromptValue]:
+        """Format the prompt for a batch of inputs, keeping the whole scratchpad."""
+        scratchpads = self._take_scratchpads(inputs)
+        base_values = format_prompts(self.base_template, inputs)
+        return self._attach_scratchpads(base_values, scratchpads)
+
+    async def _aformat_merged_prompt(self, kwargs: Dict[str, Any]) -> PromptValue:
+        """Format the prompt asynchronously."""
+        if self.token_budget is not None:
+            return (await self._afit_to_budget(kwargs))[0]
+        return await self._aformat_unbudgeted(kwargs)
+
+    async def _aformat_unbudgeted(self, kwargs: Dict[str, Any]) -> PromptValue:
+        """Format the prompt asynchronously, keeping the whole scratchpad."""
+        scratchpads = self._take_scratchpads([kwargs])
+        base_value = await aformat_prompt(self.base_template, kwargs)
+        return self._attach_scratchpads([base_value], scratchpads)[0]
+
+    def _take_scratchpads(self, inputs: List[Dict[str, Any]]) -> List[Any]:
+        """Take the scratchpads out of the inputs.
+
+        If the scratchpad is embedded in the base template, its string version is put
+        back into the inputs instead.
+        """
+        for kwargs in inputs:
+            assert (
+                self.scratchpad_key in kwargs
+            ), "Agent scratchpad must still be provided as input key"
+        scratchpads = [kwargs.pop(self.scratchpad_key) for kwargs in inputs]
+
+        if self.scratchpad_key in self.base_template.input_variables:
+            for kwargs, scratchpad in zip(inputs, scratchpads):
+                kwargs[self.scratchpad_key] = self._scratchpad_as_str(scratchpad)
+        return scratchpads
+
+    def _attach_scratchpads(
+        self, base_values: List[PromptValue], scratchpads: List[Any]
+    ) -> List[PromptValue]:
+        """Append the scratchpads to the base prompts, unless already embedded.
+
+        Embedded scratchpads get marked as the dynamic suffix of the choice prompts
+        instead.
+        """
+        if self.scratchpad_key in self.base_template.input_variables:
+            return [
+                BaseChoicePrompt.from_prompt(
+                    base_value.prompt,
+                    base_value.choices,
+                    dynamic_suffix=self._scratchpad_as_str(scratchpad),
+                )
+                if isinstance(base_value, BaseChoicePrompt)
+                else base_value
+                for base_value, scratchpad in zip(base_values, scratchpads)
+            ]
+        return [
+            ChainedPromptValue.from_subvalues(
+                self.scratchpad_joiner,
+                [base_value, self._scratchpad_as_prompt_value(scratchpad)],
+                static_count=1,
             )
+            for base_value, scratchpad in zip(base_values, scratchpads)
+        ]
+
 
+register_class(MrklPromptTemplate)
+register_function(tool_name)
+register_function(tool_description)
 
 DEFAULT_MRKL_STRING_TEMPLATE = """
 Answer the following questions as best you can. You have access to the following tools:
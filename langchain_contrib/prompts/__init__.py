@@ -1,24 +1,42 @@
 """Experimental LLM chains."""
 
+from .budget import TokenBudgetReport, estimate_tokens
 from .chained import ChainedPromptTemplate, ChainedPromptValue
+from .chat_delta import ChatDeltaPromptValue, ChatSession
 from .choice import ChoicePromptTemplate
 from .dummy import DummyPromptTemplate
 from .prefixed import PrefixedTemplate
-from .schema import Templatable, into_template
+from .schema import Templatable, interned_template, into_template
+from .scratchpad import ScratchpadPromptValue
+from .serialization import (
+    deserialize_template,
+    load_template,
+    register_class,
+    register_function,
+    save_template,
+    serialize_template,
+)
 from .z_base import (
     DefaultsTo,
     ZBasePromptTemplate,
     ZChatPromptTemplate,
     ZPromptTemplate,
     ZStringPromptTemplate,
+    aformat_prompt,
+    format_prompts,
 )
 
 __all__ = [
     "DummyPromptTemplate",
     "ChainedPromptValue",
     "ChainedPromptTemplate",
+    "ChatDeltaPromptValue",
+    "ChatSession",
     "PrefixedTemplate",
     "ChoicePromptTemplate",
+    "ScratchpadPromptValue",
+    "TokenBudgetReport",
+    "estimate_tokens",
     "Templatable",
     "ZBasePromptTemplate",
     "ZStringPromptTemplate",
@@ -26,4 +44,13 @@ __all__ = [
     "ZChatPromptTemplate",
     "DefaultsTo",
     "into_template",
+    "interned_template",
+    "format_prompts",
+    "aformat_prompt",
+    "serialize_template",
+    "deserialize_template",
+    "save_template",
+    "load_template",
+    "register_class",
+    "register_function",
 ]
@@ -0,0 +1,119 @@
+"""Module for keeping prompts within a token budget."""
+
+from __future__ import annotations
+
+import math
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel, Extra, Field
+
+TokenCounter = Callable[[str], int]
+"""Counts how many tokens a piece of text takes up."""
+
+CHARS_PER_TOKEN = 4
+"""Rough number of characters per token for English text."""
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in text from its length alone.
+
+    This is a cheap stand-in for a real tokenizer. For exact counts, use something
+    like `BaseLanguageModel.get_num_tokens` or a local tokenizer instead.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class TokenBudgetReport(BaseModel):
+    """What had to be done to a prompt to fit it within its token budget."""
+
+    budget: Optional[int] = None
+    """The token budget that the prompt had to fit in, if there was one."""
+    tokens: int = 0
+    """How many tokens the final prompt takes up."""
+    dropped_steps: List[int] = Field(default_factory=list)
+    """Indices of the scratchpad steps that were left out entirely."""
+    truncated_steps: List[int] = Field(default_factory=list)
+    """Indices of the scratchpad steps that were shortened."""
+    dropped_tokens: int = 0
+    """How many scratchpad tokens were removed in total."""
+
+    class Config:
+        """Configuration for this pydantic object."""
+
+        extra = Extra.forbid
+
+    @property
+    def within_budget(self) -> bool:
+        """Whether the final prompt fits within the budget."""
+        return self.budget is None or self.tokens <= self.budget
+
+
+def truncate_text(
+    text: str, max_tokens: int, token_counter: TokenCounter, marker: str
+) -> str:
+    """Cut off the end of the text so that it fits within max_tokens.
+
+    The marker is appended to any text that does get cut off, and counts towards
+    the limit.
+    """
+    if token_counter(text) <= max_tokens:
+        return text
+
+    # binary search for the longest prefix that still fits
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if token_counter(text[:middle] + marker) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + marker
+
+
+def fit_steps(
+    steps: Sequence[str],
+    budget: int,
+    token_counter: TokenCounter = estimate_tokens,
+    max_step_tokens: Optional[int] = None,
+    truncation_marker: str = " [truncated]",
+    elision_note: str = "",
+) -> Tuple[List[str], TokenBudgetReport]:
+    """Fit scratchpad steps within a token budget.
+
+    Steps longer than max_step_tokens are truncated first, and then the oldest steps
+    are dropped until the rest fits. If any steps get dropped, the elision note is
+    put in their place, with `{count}` replaced by how many steps were dropped.
+
+    Returns:
+        The steps that were kept, and a report of what was removed. The report's
+        token count only covers the steps, not the rest of the prompt.
+    """
+    report = TokenBudgetReport(budget=budget)
+    fitted = list(steps)
+    counts = [token_counter(step) for step in fitted]
+    original_total = sum(counts)
+
+    if max_step_tokens is not None and original_total > budget:
+        for i, step in enumerate(fitted):
+            if counts[i] > max_step_tokens:
+                fitted[i] = truncate_text(
+                    step, max_step_tokens, token_counter, truncation_marker
+                )
+                counts[i] = token_counter(fitted[i])
+                report.truncated_steps.append(i)
+
+    remaining = sum(counts)
+    start = 0
+    note = ""
+    while start < len(fitted) and remaining + token_counter(note) > budget:
+        remaining -= counts[start]
+        start += 1
+        if elision_note:
+            note = elision_note.format(count=start)
+
+    report.dropped_steps = list(range(start))
+    # a step that got truncated and then dropped only counts as dropped
+    report.truncated_steps = [i for i in report.truncated_steps if i >= start]
+    report.dropped_tokens = original_total - remaining
+    report.tokens = remaining + token_counter(note)
+    return ([note] if note else []) + fitted[start:], report
@@ -1,18 +1,69 @@
 """Defines the Chained prompt template type."""
 
-from typing import Any, List
+from __future__ import annotations
+
+import asyncio
+import hashlib
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
 
 from langchain.prompts.base import BasePromptTemplate
 from langchain.schema import BaseMessage, PromptValue
+from pydantic import PrivateAttr, root_validator
 
-from langchain_contrib.utils import f_join, safe_inputs
+from langchain_contrib.utils import f_join, profiled
 
 from .schema import Templatable, into_template
-from .z_base import ZStringPromptTemplate
+from .z_base import ZStringPromptTemplate, aformat_prompt, format_prompts
+
+
+def _splices_into(subvalue: PromptValue, joiner: str) -> bool:
+    """Whether the subvalue is a nested chain that can be spliced into its parent.
+
+    Empty chains stay as they are, because they still take up a joiner.
+    """
+    return (
+        isinstance(subvalue, ChainedPromptValue)
+        and subvalue.joiner == joiner
+        and bool(subvalue.subvalues)
+    )
+
+
+def _flatten_subvalues(
+    joiner: str, subvalues: List[PromptValue], static_count: int
+) -> Tuple[List[PromptValue], int]:
+    """Splice in the subvalues of nested chains that join the same way.
+
+    Returns the flattened subvalues, along with the static count adjusted to match.
+    """
+    if not any(_splices_into(x, joiner) for x in subvalues):
+        return subvalues, static_count
+
+    flattened: List[PromptValue] = []
+    new_static_count = static_count
+    for i, subvalue in enumerate(subvalues):
+        if i == static_count:
+            new_static_count = len(flattened)
+        if _splices_into(subvalue, joiner):
+            assert isinstance(subvalue, ChainedPromptValue)
+            flattened.extend(subvalue.subvalues)
+        else:
+            flattened.append(subvalue)
+    if static_count >= len(subvalues):
+        new_static_count = len(flattened)
+    return flattened, new_static_count
+
+
+def hash_prefix(prefix: str) -> str:
+    """Hash a static prefix for use as a cache key."""
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()
 
 
 class ChainedPromptValue(PromptValue):
-    """A prompt value consisting of smaller prompt values."""
+    """A prompt value consisting of smaller prompt values.
+
+    Prompt values are treated as immutable, so the rendered string and messages are
+    only computed once and then cached on this object.
+    """
 
     joiner: str = ""
     """How to join each prompt value together.
@@ -20,17 +71,99 @@ class ChainedPromptValue(PromptValue):
     Only used when joining to_string.
     """
     subvalues: List[PromptValue]
+    """The prompt values to chain together.
+
+    Nested ChainedPromptValues with the same joiner are flattened into this list,
+    unless they're empty.
+    """
+    static_count: int = 0
+    """How many of the leading subvalues stay the same from one prompt to the next.
+
+    Backends that reuse work for prompts sharing an exact prefix can use the static
+    prefix and its hash to do so. Nested chains that get flattened count as however
+    many subvalues they contain.
+    """
+
+    _string: Optional[str] = PrivateAttr(default=None)
+    _messages: Optional[List[BaseMessage]] = PrivateAttr(default=None)
+    _prefix: Optional[str] = PrivateAttr(default=None)
+
+    @root_validator
+    def flatten_subvalues(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        """Splice in the subvalues of nested chains that join the same way."""
+        values["subvalues"], values["static_count"] = _flatten_subvalues(
+            values.get("joiner", ""),
+            values.get("subvalues", []),
+            values.get("static_count", 0),
+        )
+        return values
+
+    @classmethod
+    def from_subvalues(
+        cls, joiner: str, subvalues: List[PromptValue], static_count: int = 0
+    ) -> ChainedPromptValue:
+        """Chain prompt values together without validating them all over again.
+
+        Templates use this, since the values they produce are already valid.
+        """
+        subvalues, static_count = _flatten_subvalues(joiner, subvalues, static_count)
+        return cls.construct(
+            joiner=joiner, subvalues=subvalues, static_count=static_count
+        )
 
+    def copy(self, **kwargs: Any) -> ChainedPromptValue:
+        """Copy the value, starting out without any cached renderings.
+
+        The cached renderings may not apply to the copy, such as when the joiner or
+        the subvalues get updated.
+        """
+        result = super().copy(**kwargs)
+        result._init_private_attributes()
+        return result
+
+    def static_prefix(self) -> str:
+        """Return the start of to_string that is made up of the static subvalues.
+
+        The joiner that follows the last static subvalue is included too, so that the
+        result is always an exact prefix of the full string.
+        """
+        if self._prefix is None:
+            static = [x.to_string() for x in self.subvalues[: self.static_count]]
+            prefix = self.joiner.join(static)
+            if static and self.static_count < len(self.subvalues):
+                prefix += self.joiner
+            self._prefix = prefix
+        return self._prefix
+
+    def static_messages(self) -> List[BaseMessage]:
+        """Return the messages that come from the static subvalues."""
+        return [
+            message
+            for subvalue in self.subvalues[: self.static_count]
+            for message in subvalue.to_messages()
+        ]
+
+    def prefix_hash(self) -> str:
+        """Return a SHA-256 hash of the static prefix, for use as a cache key."""
+        return hash_prefix(self.static_prefix())
+
+    @profiled()
     def to_string(self) -> str:
         """Join prompt values together as a single string."""
-        return f_join(self.joiner, [x.to_string() for x in self.subvalues])
+        if self._string is None:
+            self._string = f_join(self.joiner, [x.to_string() for x in self.subvalues])
+        return self._string
 
+    @profiled()
     def to_messages(self) -> List[BaseMessage]:
         """Append all prompt values together as messages."""
-        messages = [
-            message for subvalue in self.subvalues for message in subvalue.to_messages()
-        ]
-        return messages
+        if self._messages is None:
+            self._messages = [
+                message
+                for subvalue in self.subvalues
+                for message in subvalue.to_messages()
+            ]
+        return list(self._messages)
 
 
 class ChainedPromptTemplate(ZStringPromptTemplate):
@@ -47,6 +180,13 @@ class ChainedPromptTemplate(ZStringPromptTemplate):
     """
     subprompts: List[BasePromptTemplate]
 
+    _routes: List[Tuple[BasePromptTemplate, Tuple[str, ...]]] = PrivateAttr(
+        default_factory=list
+    )
+    """Each subprompt, along with the input variables that get routed to it."""
+    _routed_variables: FrozenSet[str] = PrivateAttr(default=frozenset())
+    """All input variables that get routed to at least one subprompt."""
+
     def __init__(self, subprompts: List[Templatable], joiner: str = "", **kwargs: Any):
         """Initialize a ChainedPromptTemplate.
 
@@ -56,26 +196,87 @@ class ChainedPromptTemplate(ZStringPromptTemplate):
         kwargs["joiner"] = joiner
         kwargs["subprompts"] = prompts
         kwargs["input_variables"] = list(
-            set([var for subprompt in prompts for var in subprompt.input_variables])
+            dict.fromkeys(
+                var for subprompt in prompts for var in subprompt.input_variables
+            )
         )
         super().__init__(**kwargs)
+        self._get_routes()
+
+    def _get_routes(self) -> List[Tuple[BasePromptTemplate, Tuple[str, ...]]]:
+        """Get the routing table, recomputing it if the subprompts have changed.
+
+        It may not exist yet if this template was constructed without validation or
+        loaded from a pickle, and it gets stale if subprompts are replaced later on.
+        """
+        routes = self._routes
+        if len(routes) != len(self.subprompts) or any(
+            route[0] is not subprompt
+            for route, subprompt in zip(routes, self.subprompts)
+        ):
+            self._routes = [
+                (subprompt, tuple(subprompt.input_variables))
+                for subprompt in self.subprompts
+            ]
+            self._routed_variables = frozenset(
+                var for _, variables in self._routes for var in variables
+            )
+        return self._routes
 
     def format(self, **kwargs: Any) -> str:
         """Format the prompt with the inputs."""
         return self.format_prompt(**kwargs).to_string()
 
-    def _format_prompt(self, **kwargs: Any) -> PromptValue:
-        """Format each series of prompts with the given inputs."""
-        unused_args = set(kwargs.keys())
-        values: List[PromptValue] = []
-        for subprompt in self.subprompts:
-            prompt_args = safe_inputs(subprompt, kwargs)
-            unused_args -= prompt_args.keys()
-            values.append(subprompt.format_prompt(**prompt_args))
+    def _check_unused_args(self, kwargs: Dict[str, Any]) -> None:
+        """Complain about arguments that don't go to any subprompt."""
+        unused_args = kwargs.keys() - self._routed_variables
         if unused_args:
             raise KeyError(unused_args)
 
-        return ChainedPromptValue(joiner=self.joiner, subvalues=values)
+    def _format_prompt(self, **kwargs: Any) -> PromptValue:
+        """Format each series of prompts with the given inputs."""
+        routes = self._get_routes()
+        self._check_unused_args(kwargs)
+        values = [
+            subprompt.format_prompt(**{k: kwargs[k] for k in variables if k in kwargs})
+            for subprompt, variables in routes
+        ]
+        return ChainedPromptValue.from_subvalues(self.joiner, values)
+
+    async def _aformat_merged_prompt(self, kwargs: Dict[str, Any]) -> PromptValue:
+        """Format all subprompts concurrently."""
+        routes = self._get_routes()
+        self._check_unused_args(kwargs)
+        values = await asyncio.gather(
+            *(
+                aformat_prompt(
+                    subprompt, {k: kwargs[k] for k in variables if k in kwargs}
+                )
+                for subprompt, variables in routes
+            )
+        )
+        return ChainedPromptValue.from_subvalues(self.joiner, list(values))
+
+    def _format_merged_prompts(self, inputs: List[Dict[str, Any]]) -> List[PromptValue]:
+        """Format each subprompt for the whole batch before chaining them together."""
+        routes = self._get_routes()
+        for kwargs in inputs:
+            self._check_unused_args(kwargs)
+        columns = [
+            format_prompts(
+                subprompt,
+                [{k: kw[k] for k in variables if k in kw} for kw in inputs],
+            )
+            for subprompt, variables in routes
+        ]
+        if not columns:
+            # zip would produce no rows at all, rather than one empty row per input
+            return [ChainedPromptValue.from_subvalues(self.joiner, []) for _ in inputs]
+
+        return [
+            ChainedPromptValue.from_subvalues(self.joiner, list(values))
+            for values in zip(*columns)
+        ]
 
     @property
     def _prompt_type(self) -> str:
@@ -0,0 +1,94 @@
+"""Module for only sending the chat messages that are new since the last prompt."""
+
+from __future__ import annotations
+
+from typing import List, Sequence
+
+from langchain.schema import BaseMessage, PromptValue
+
+
+def _same_message(a: BaseMessage, b: BaseMessage) -> bool:
+    """Whether two messages have the same contents.
+
+    Cheaper than pydantic equality, which converts both messages to dicts first.
+    """
+    return a is b or (
+        type(a) is type(b)
+        and a.content == b.content
+        and a.additional_kwargs == b.additional_kwargs
+        and getattr(a, "role", None) == getattr(b, "role", None)
+    )
+
+
+class ChatDeltaPromptValue(PromptValue):
+    """A chat prompt value that knows which of its messages were already sent.
+
+    Create these with `ChatSession.delta`, which also avoids the validation that
+    would otherwise copy every message.
+    """
+
+    value: PromptValue
+    """The full prompt value that this delta is for."""
+    messages: List[BaseMessage]
+    """All messages of the prompt, reusing message instances from earlier prompts."""
+    start: int = 0
+    """Index of the first message that wasn't part of the previous prompt."""
+    continues_session: bool = True
+    """Whether all messages of the previous prompt are still at the start of this one.
+
+    If not, the earlier history was changed and backends should start over.
+    """
+
+    @property
+    def new_messages(self) -> List[BaseMessage]:
+        """The messages that weren't part of the previous prompt."""
+        return self.messages[self.start :]
+
+    def to_string(self) -> str:
+        """Return the full prompt as a string."""
+        return self.value.to_string()
+
+    def to_messages(self) -> List[BaseMessage]:
+        """Return the full list of messages."""
+        return list(self.messages)
+
+
+class ChatSession:
+    """Remembers the messages already produced for one chat.
+
+    Successive prompts in an agent loop mostly repeat the previous prompt's messages.
+    Running each prompt through `delta` reuses the previous message instances for
+    the repeated part and points out the new tail, so that backends with delta
+    support and logs only have to deal with the new messages.
+    """
+
+    def __init__(self) -> None:
+        """Start a session without any history."""
+        self.messages: List[BaseMessage] = []
+
+    def _common_length(self, messages: Sequence[BaseMessage]) -> int:
+        """Count how many leading messages are the same as in the history."""
+        common = 0
+        for old, new in zip(self.messages, messages):
+            if not _same_message(old, new):
+                break
+            common += 1
+        return common
+
+    def delta(self, value: PromptValue) -> ChatDeltaPromptValue:
+        """Record the prompt in the session and find out what is new in it."""
+        messages = value.to_messages()
+        common = self._common_length(messages)
+        reused = self.messages[:common] + messages[common:]
+        result = ChatDeltaPromptValue.construct(
+            value=value,
+            messages=reused,
+            start=common,
+            continues_session=common == len(self.messages),
+        )
+        self.messages = reused
+        return result
+
+    def reset(self) -> None:
+        """Forget the history, so that the next prompt is sent in full."""
+        self.messages = []
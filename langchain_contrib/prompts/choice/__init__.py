@@ -6,6 +6,7 @@ from .prompt_value import (
     ChoiceStr,
     StringChoicePrompt,
 )
+from .retrieval import BM25ChoiceRetriever
 from .template import (
     ChoicePromptTemplate,
     get_oxford_comma_formatter,
@@ -22,4 +23,5 @@ __all__ = [
     "get_simple_joiner",
     "get_oxford_comma_formatter",
     "list_of_choices",
+    "BM25ChoiceRetriever",
 ]
@@ -2,13 +2,17 @@
 
 from __future__ import annotations
 
-from typing import List
+from typing import Any, List, Optional, Tuple, Type
 
 from fvalues import F
 from langchain.prompts.base import StringPromptValue
 from langchain.prompts.chat import ChatPromptValue
 from langchain.schema import BaseMessage, PromptValue
-from pydantic import Extra
+from pydantic import Extra, PrivateAttr
+
+from langchain_contrib.utils import profiled
+
+from ..chained import hash_prefix
 
 
 class ChoiceStr(F):
@@ -17,11 +21,20 @@ class ChoiceStr(F):
     choices: List[str]
 
     def __new__(cls, f_str: F, choices: List[str]) -> ChoiceStr:
-        """Create a new ChoiceStr with cached choices."""
-        result = super().__new__(cls, f_str, parts=f_str.parts)
+        """Create a new ChoiceStr with cached choices.
+
+        The parts of an existing F-string are already known to add up to the string,
+        so they are reused as-is instead of being checked all over again.
+        """
+        result = str.__new__(cls, f_str)
+        result.parts = f_str.parts
         result.choices = choices
         return result
 
+    def __getnewargs__(self) -> Tuple[F, List[str]]:  # type: ignore[override]
+        """Recreate the ChoiceStr from its parts and choices when unpickling."""
+        return F(str.__str__(self), parts=self.parts), self.choices
+
 
 class BaseChoicePrompt(PromptValue):
     """A prompt that involves picking from a number of choices.
@@ -34,6 +47,16 @@ class BaseChoicePrompt(PromptValue):
     """The encapsulated prompt that provides the actual prompt value."""
     choices: List[str]
     """The list of choices to choose from."""
+    dynamic_suffix: Optional[str] = None
+    """The text at the end of the prompt that changes from one prompt to the next.
+
+    If set, everything before it is treated as the static prefix of the prompt, as
+    with ChainedPromptValue. Nothing is considered static if the prompt doesn't
+    actually end with this text.
+    """
+
+    _string: Optional[str] = PrivateAttr(default=None)
+    """The cached string rendering of this prompt."""
 
     class Config:
         """Configuration for this pydantic object."""
@@ -48,36 +71,115 @@ class BaseChoicePrompt(PromptValue):
         """Return prompt as messages."""
         return self.prompt.to_messages()
 
+    def _ends_with_suffix(self) -> bool:
+        """Whether the dynamic suffix is set and really is at the end of the prompt."""
+        return self.dynamic_suffix is not None and self.to_string().endswith(
+            self.dynamic_suffix
+        )
+
+    def static_prefix(self) -> str:
+        """Return the start of to_string that comes before the dynamic suffix."""
+        if not self._ends_with_suffix():
+            return ""
+        assert self.dynamic_suffix is not None
+        string = self.to_string()
+        return string[: len(string) - len(self.dynamic_suffix)]
+
+    def static_messages(self) -> List[BaseMessage]:
+        """Return the messages before the last one, which holds the dynamic suffix."""
+        if not self._ends_with_suffix():
+            return []
+        return self.to_messages()[:-1]
+
+    def prefix_hash(self) -> str:
+        """Return a SHA-256 hash of the static prefix, for use as a cache key."""
+        return hash_prefix(self.static_prefix())
+
+    def _render_fields(self) -> None:
+        """Fill in the fields that get rendered from the wrapped prompt.
+
+        Serialization, comparison and repr then all see the same rendered content,
+        no matter which of it has been accessed so far.
+        """
+
+    def _iter(self, *args: Any, **kwargs: Any) -> Any:
+        """Render the fields before pydantic goes through them."""
+        self._render_fields()
+        return super()._iter(*args, **kwargs)
+
+    def __repr_args__(self) -> Any:
+        """Render the fields before they get shown."""
+        self._render_fields()
+        return super().__repr_args__()
+
+    def copy(self, **kwargs: Any) -> BaseChoicePrompt:
+        """Copy the prompt, starting out without a cached string rendering.
+
+        The cached rendering may not apply to the copy, such as when the wrapped
+        prompt gets updated.
+        """
+        result = super().copy(**kwargs)
+        result._init_private_attributes()
+        result._render_fields()
+        return result
+
     def _wrap_choice_str(self, str_prompt: str) -> ChoiceStr:
         """Wrap a prompt in ChoiceStr before returning."""
         if isinstance(str_prompt, F):
             f_prompt = str_prompt
         else:
-            f_prompt = F(str_prompt)
+            f_prompt = F(str_prompt, parts=(str_prompt,))
         return ChoiceStr(f_prompt, self.choices)
 
+    def _render_choice_str(self) -> str:
+        """Render the wrapped prompt as a ChoiceStr only once."""
+        if self._string is None:
+            self._string = self._wrap_choice_str(self.prompt.to_string())
+        return self._string
+
     @classmethod
-    def from_prompt(cls, prompt: PromptValue, choices: List[str]) -> BaseChoicePrompt:
-        """Create one of the child classes from a base prompt."""
+    @profiled("BaseChoicePrompt.from_prompt")
+    def from_prompt(
+        cls,
+        prompt: PromptValue,
+        choices: List[str],
+        dynamic_suffix: Optional[str] = None,
+    ) -> BaseChoicePrompt:
+        """Create one of the child classes from a base prompt.
+
+        The prompt is not rendered until the choice prompt itself gets rendered, and
+        the already-typed arguments are not validated all over again.
+        """
         if isinstance(prompt, StringPromptValue):
-            return StringChoicePrompt(
-                text=prompt.to_string(), prompt=prompt, choices=choices
-            )
+            prompt_class: Type[BaseChoicePrompt] = StringChoicePrompt
         elif isinstance(prompt, ChatPromptValue):
-            return ChatChoicePrompt(
-                messages=prompt.to_messages(), prompt=prompt, choices=choices
-            )
+            prompt_class = ChatChoicePrompt
         else:
-            return cls(prompt=prompt, choices=choices)
+            prompt_class = cls
+        return prompt_class.construct(
+            prompt=prompt, choices=choices, dynamic_suffix=dynamic_suffix
+        )
 
 
 class StringChoicePrompt(BaseChoicePrompt, StringPromptValue):
     """A string prompt that involves picking from a number of choices."""
 
+    def __getattr__(self, name: str) -> Any:
+        """Render text on demand if it wasn't provided upon construction."""
+        if name == "text":
+            self._render_fields()
+            return self.__dict__["text"]
+        raise AttributeError(
+            f"'{type(self).__name__}' object has no attribute '{name}'"
+        )
+
+    def _render_fields(self) -> None:
+        """Fill in the rendered text."""
+        self.__dict__["text"] = self.to_string()
+
     def to_string(self) -> str:
         """Return prompt as string."""
-        str_prompt = self.prompt.to_string()
-        return self._wrap_choice_str(str_prompt)
+        return self._render_choice_str()
 
     def to_messages(self) -> List[BaseMessage]:
         """Return prompt as messages."""
@@ -87,10 +189,22 @@ class StringChoicePrompt(BaseChoicePrompt, StringPromptValue):
 class ChatChoicePrompt(BaseChoicePrompt, ChatPromptValue):
     """A chat prompt that involves picking from a number of choices."""
 
+    def __getattr__(self, name: str) -> Any:
+        """Render messages on demand if they weren't provided upon construction."""
+        if name == "messages":
+            self._render_fields()
+            return self.__dict__["messages"]
+        raise AttributeError(
+            f"'{type(self).__name__}' object has no attribute '{name}'"
+        )
+
+    def _render_fields(self) -> None:
+        """Fill in the rendered messages."""
+        self.__dict__["messages"] = self.to_messages()
+
     def to_string(self) -> str:
         """Return prompt as string."""
-        str_prompt = self.prompt.to_string()
-        return self._wrap_choice_str(str_prompt)
+        return self._render_choice_str()
 
     def to_messages(self) -> List[BaseMessage]:
         """Return prompt as messages."""
@@ -0,0 +1,164 @@
+"""Module for shortlisting the choices most relevant to the current input."""
+
+from __future__ import annotations
+
+import heapq
+import math
+import re
+from collections import Counter
+from functools import partial
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from pydantic import BaseModel, Extra, Field, PrivateAttr
+
+from langchain_contrib.utils import BoundedCache
+
+TOKEN_REGEX = re.compile(r"\w+")
+
+INDEX_CACHE_SIZE = 8
+"""How many indexed choice lists each retriever remembers."""
+
+SHORTLIST_CACHE_SIZE = 256
+"""How many shortlists each retriever remembers."""
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens."""
+    return TOKEN_REGEX.findall(text.lower())
+
+
+class BM25Index:
+    """A small in-memory BM25 index over a fixed list of documents."""
+
+    __slots__ = ("k1", "b", "postings", "idf", "doc_norms")
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        """Index the documents once."""
+        self.k1 = k1
+        self.b = b
+        term_counts = [Counter(tokenize(document)) for document in documents]
+        lengths = [sum(counts.values()) for counts in term_counts]
+        average_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc_index, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                self.postings.setdefault(term, []).append((doc_index, count))
+
+        n_docs = len(documents)
+        self.idf = {
+            term: math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+        self.doc_norms = [
+            k1 * (1 - b + b * length / average_length) if average_length else k1
+            for length in lengths
+        ]
+
+    def scores(self, query: str) -> Dict[int, float]:
+        """Score every document that shares at least one term with the query."""
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_index, count in self.postings[term]:
+                score = (
+                    idf * count * (self.k1 + 1) / (count + self.doc_norms[doc_index])
+                )
+                scores[doc_index] = scores.get(doc_index, 0.0) + score
+        return scores
+
+    def top_k(self, query: str, k: int) -> List[int]:
+        """Return the indices of the k best documents, in their original order.
+
+        If fewer than k documents match the query at all, the remaining slots are
+        filled with the earliest unmatched documents.
+        """
+        scores = self.scores(query)
+        best = heapq.nlargest(k, scores, key=lambda i: (scores[i], -i))
+        if len(best) < k:
+            chosen = set(best)
+            n_docs = len(self.doc_norms)
+            best.extend([i for i in range(n_docs) if i not in chosen][: k - len(best)])
+        return sorted(best)
+
+
+class BM25ChoiceRetriever(BaseModel):
+    """Shortlists the top-k choices that are most relevant to a query.
+
+    Choices are indexed with BM25 the first time a given choices list is seen, so
+    later queries against the same list only cost as much as scoring the query.
+    """
+
+    k: int = 5
+    """How many choices to keep."""
+    document_serializer: Callable[[Any], str] = Field(default=str)
+    """How to turn a choice into the text that gets searched over."""
+    k1: float = 1.5
+    """BM25 term frequency saturation parameter."""
+    b: float = 0.75
+    """BM25 document length normalization parameter."""
+
+    _indexes: BoundedCache[Tuple[int, ...], Tuple[Any, BM25Index]] = PrivateAttr(
+        default_factory=partial(BoundedCache, INDEX_CACHE_SIZE)
+    )
+    _shortlists: BoundedCache[
+        Tuple[Tuple[int, ...], str], Tuple[Any, List[Any]]
+    ] = PrivateAttr(default_factory=partial(BoundedCache, SHORTLIST_CACHE_SIZE))
+
+    class Config:
+        """Configuration for this pydantic object."""
+
+        extra = Extra.forbid
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Leave the indexes out of pickles, since they reference the choices."""
+        state = super().__getstate__()
+        state["__private_attribute_values__"] = {}
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """Start out with empty indexes after unpickling."""
+        super().__setstate__(state)
+        self._init_private_attributes()
+
+    def copy(self, **kwargs: Any) -> BM25ChoiceRetriever:
+        """Copy the retriever, starting out with empty indexes.
+
+        The indexes may not apply to the copy, such as when the document serializer
+        gets updated.
+        """
+        result = super().copy(**kwargs)
+        result._init_private_attributes()
+        return result
+
+    def _get_index(self, choices: List[Any]) -> BM25Index:
+        """Get the index for this list of choices, building it if necessary."""
+        key = tuple(map(id, choices))
+        cached = self._indexes.get(key)
+        if cached is None:
+            documents = [self.document_serializer(choice) for choice in choices]
+            # keep references to the choices so that their ids can't get reused
+            cached = self._indexes.put(
+                key, (tuple(choices), BM25Index(documents, k1=self.k1, b=self.b))
+            )
+        return cached[1]
+
+    def shortlist(self, choices: List[Any], query: str) -> List[Any]:
+        """Pick the k choices most relevant to the query.
+
+        The same shortlist object is returned for repeated queries, so that
+        downstream caching of serialized choices keeps working.
+        """
+        if len(choices) <= self.k:
+            return choices
+
+        key = (tuple(map(id, choices)), query)
+        cached = self._shortlists.get(key)
+        if cached is None:
+            indices = self._get_index(choices).top_k(query, self.k)
+            cached = self._shortlists.put(
+                key, (tuple(choices), [choices[i] for i in indices])
+            )
+        return cached[1]
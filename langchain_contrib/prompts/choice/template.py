@@ -1,52 +1,67 @@
 """Module that defines the choice prompt."""
 from __future__ import annotations
 
-from typing import Any, Callable, Generic, List, Sequence, TypeVar, Union
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from langchain.prompts.base import BasePromptTemplate
 from langchain.prompts.chat import BaseMessagePromptTemplate
-from langchain.schema import BaseMessage
-from pydantic import Field
+from langchain.schema import BaseMessage, PromptValue
+from pydantic import Field, PrivateAttr
 
 from langchain_contrib.prompts.z_base import (
     DefaultsTo,
     ZBasePromptTemplate,
     ZChatPromptTemplate,
     ZPromptTemplate,
+    aformat_prompt,
+    format_prompts,
 )
-from langchain_contrib.utils import f_join
+from langchain_contrib.utils import BoundedCache, FRope, f_join, profiled
 
 from .prompt_value import BaseChoicePrompt
+from .retrieval import BM25ChoiceRetriever
 
 ChoicesFormatter = Callable[[List[str]], str]
 
 
+def simple_join_choice(choices: List[str], joiner: str = ", ") -> str:
+    """Do a simple join on the choice strings."""
+    return f_join(joiner, choices)
+
+
 def get_simple_joiner(joiner: str = ", ") -> ChoicesFormatter:
     """Get a choice formatter that's just a simple joining of strings."""
+    return partial(simple_join_choice, joiner=joiner)
 
-    def simple_join_choice(choices: List[str]) -> str:
-        """Do a simple join on the choice strings."""
-        return f_join(joiner, choices)
 
-    return simple_join_choice
+def oxford_comma_list(choices: List[str], conjunction: str = "or") -> str:
+    """Phrase the list using the Oxford comma."""
+    if len(choices) == 0:
+        return ""
+    elif len(choices) == 1:
+        return choices[0]
+    elif len(choices) == 2:
+        return f_join(f" {conjunction} ", choices)
+    else:
+        head = FRope(", ", choices[:-1])
+        return f_join(f", {conjunction} ", [head, choices[-1]])
 
 
 def get_oxford_comma_formatter(conjunction: str = "or") -> ChoicesFormatter:
     """Get a choice formatter that respects the Oxford comma."""
-
-    def oxford_comma_list(choices: List[str]) -> str:
-        """Phrase the list using the Oxford comma."""
-        if len(choices) == 0:
-            return ""
-        elif len(choices) == 1:
-            return choices[0]
-        elif len(choices) == 2:
-            return f_join(f" {conjunction} ", choices)
-        else:
-            head = f_join(", ", choices[:-1])
-            return f_join(f", {conjunction} ", [head, choices[-1]])
-
-    return oxford_comma_list
+    return partial(oxford_comma_list, conjunction=conjunction)
 
 
 def list_of_choices(choices: List[str]) -> str:
@@ -56,6 +71,9 @@ def list_of_choices(choices: List[str]) -> str:
 
 T = TypeVar("T")
 
+SERIALIZATION_CACHE_SIZE = 32
+"""How many serialized choice lists each ChoicePromptTemplate remembers."""
+
 
 class ChoicePromptTemplate(ZBasePromptTemplate, Generic[T]):
     """A wrapper prompt template for picking from a number of choices.
@@ -64,7 +82,7 @@ class ChoicePromptTemplate(ZBasePromptTemplate, Generic[T]):
     """
 
     """The base template that this class wraps around."""
-    choice_serializer: Callable[[T], str] = lambda x: str(x)
+    choice_serializer: Callable[[T], str] = Field(default=str)
     """How to turn the choices into strings."""
     choices_formatter: ChoicesFormatter = Field(
         default_factory=get_oxford_comma_formatter
@@ -79,6 +97,21 @@ class ChoicePromptTemplate(ZBasePromptTemplate, Generic[T]):
     """
     choice_format_key: str = "choices"
     """Which string is used for formatting choices in the template."""
+    choice_retriever: Optional[BM25ChoiceRetriever] = None
+    """If set, only the choices most relevant to the query get put into the prompt.
+
+    Useful for large catalogs of choices that would otherwise bloat the prompt.
+    """
+    retrieval_query_key: str = "input"
+    """Which input is used as the query for the choice retriever."""
+
+    _serialized: BoundedCache[Tuple[Any, ...], Tuple[Any, ...]] = PrivateAttr(
+        default_factory=partial(BoundedCache, SERIALIZATION_CACHE_SIZE)
+    )
+    """Previously serialized choices.
+
+    Keyed by the identities of each choice, the serializer, and the formatter.
+    """
 
     @classmethod
     def from_base_template(
@@ -129,10 +162,39 @@ class ChoicePromptTemplate(ZBasePromptTemplate, Generic[T]):
         """Format the prompt with the inputs."""
         return self.format_prompt(**kwargs).to_string()
 
+    @profiled()
     def format_prompt(self, **kwargs: Any) -> BaseChoicePrompt:
         """Format the prompt while preserving the choices."""
         kwargs = self._merge_partial_and_user_variables(**kwargs)
+        str_choices = self._serialize_choices_into(kwargs)
+        prompt = self._get_base_template().format_prompt(**kwargs)
+        return BaseChoicePrompt.from_prompt(prompt, choices=str_choices)
+
+    async def _aformat_merged_prompt(self, kwargs: Dict[str, Any]) -> PromptValue:
+        """Format the prompt asynchronously while preserving the choices."""
+        str_choices = self._serialize_choices_into(kwargs)
+        prompt = await aformat_prompt(self._get_base_template(), kwargs)
+        return BaseChoicePrompt.from_prompt(prompt, choices=str_choices)
 
+    def _format_merged_prompts(self, inputs: List[Dict[str, Any]]) -> List[PromptValue]:
+        """Format a batch of prompts, serializing each distinct choices list once."""
+        all_str_choices = [self._serialize_choices_into(kwargs) for kwargs in inputs]
+
+        prompts = format_prompts(self._get_base_template(), inputs)
+        return [
+            BaseChoicePrompt.from_prompt(prompt, choices=str_choices)
+            for prompt, str_choices in zip(prompts, all_str_choices)
+        ]
+
+    def _get_base_template(self) -> BasePromptTemplate:
+        """Get the base template, which must exist for choice templates."""
+        assert (
+            self.base_template is not None
+        ), "ChoicePromptTemplate requires a base template to be provided"
+        return self.base_template
+
+    def _get_choices(self, kwargs: Dict[str, Any]) -> List[T]:
+        """Get the list of choices out of the merged arguments."""
         if self.choice_format_key not in kwargs:
             raise ValueError(
                 f"Choice key '{self.choice_format_key}' not in args: {kwargs}"
@@ -142,11 +204,43 @@ class ChoicePromptTemplate(ZBasePromptTemplate, Generic[T]):
             "Choices must be passed in as list, but is instead "
             f"{type(choices).__name__}: {choices}"
         )
-        str_choices = [self.choice_serializer(c) for c in choices]
-        kwargs[self.choice_format_key] = self.choices_formatter(str_choices)
+        return choices
 
-        assert (
-            self.base_template is not None
-        ), "ChoicePromptTemplate requires a base template to be provided"
-        prompt = self.base_template.format_prompt(**kwargs)
-        return BaseChoicePrompt.from_prompt(prompt, choices=str_choices)
+    @profiled("ChoicePromptTemplate.serialize_choices")
+    def _serialize_choices(self, choices: List[T]) -> Tuple[List[str], str]:
+        """Turn the choices into strings, and then into a single string.
+
+        Results are cached, so that formatting the same choices again is cheap.
+        """
+        serializer = self.choice_serializer
+        formatter = self.choices_formatter
+        key = (tuple(map(id, choices)), id(serializer), id(formatter))
+        cached = self._serialized.get(key)
+        if cached is None:
+            str_choices = tuple(serializer(c) for c in choices)
+            formatted = formatter(list(str_choices))
+            # keep references around so that the ids in the key can't get reused
+            cached = self._serialized.put(
+                key, (tuple(choices), serializer, formatter, str_choices, formatted)
+            )
+        # hand out a fresh list, so that nobody can modify the cached one
+        return list(cached[3]), cached[4]
+
+    def _shortlist_choices(self, choices: List[T], kwargs: Dict[str, Any]) -> List[T]:
+        """Narrow down the choices with the retriever, if there is one."""
+        if self.choice_retriever is None:
+            return choices
+        if self.retrieval_query_key not in kwargs:
+            raise ValueError(
+                f"Retrieval query key '{self.retrieval_query_key}' not in args: "
+                f"{kwargs}"
+            )
+        query = str(kwargs[self.retrieval_query_key])
+        return self.choice_retriever.shortlist(choices, query)
+
+    def _serialize_choices_into(self, kwargs: Dict[str, Any]) -> List[str]:
+        """Replace the choices in the arguments with their formatted version."""
+        choices = self._shortlist_choices(self._get_choices(kwargs), kwargs)
+        str_choices, formatted = self._serialize_choices(choices)
+        kwargs[self.choice_format_key] = formatted
+        return str_choices
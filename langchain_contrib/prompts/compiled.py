@@ -0,0 +1,129 @@
+"""Module for compiling template text once so that it can be formatted quickly."""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from string import Formatter
+from typing import Any, Callable, Dict, FrozenSet, List, Tuple, Union
+
+from langchain.prompts.base import DEFAULT_FORMATTER_MAPPING
+
+Segment = Union[str, Tuple[str, str, str]]
+"""Either a literal string, or a (variable, conversion, format spec) triple."""
+
+_CONVERSIONS: Dict[str, Callable[[Any], str]] = {"r": repr, "s": str, "a": ascii}
+
+
+class CompiledTemplate:
+    """A template that has already been parsed and is ready for formatting."""
+
+    __slots__ = ()
+
+    def format(self, kwargs: Dict[str, Any]) -> str:
+        """Format the template with the given arguments."""
+        raise NotImplementedError()
+
+
+class CompiledFString(CompiledTemplate):
+    """An f-string template that has been pre-split into its segments.
+
+    Formatting behaves like langchain's strict f-string formatter: missing and extra
+    arguments both raise a KeyError.
+    """
+
+    __slots__ = ("segments", "variables")
+
+    def __init__(self, segments: List[Segment]) -> None:
+        """Create a compiled f-string out of its literal and variable segments."""
+        self.segments = segments
+        self.variables: FrozenSet[str] = frozenset(
+            s[0] for s in segments if not isinstance(s, str)
+        )
+
+    def format(self, kwargs: Dict[str, Any]) -> str:
+        """Join the literal segments with the formatted variables."""
+        extra = kwargs.keys() - self.variables
+        if extra:
+            raise KeyError(extra)
+
+        pieces = []
+        for segment in self.segments:
+            if isinstance(segment, str):
+                pieces.append(segment)
+            else:
+                name, conversion, format_spec = segment
+                value = kwargs[name]
+                if conversion:
+                    value = _CONVERSIONS[conversion](value)
+                pieces.append(format(value, format_spec))
+        return "".join(pieces)
+
+
+class FallbackTemplate(CompiledTemplate):
+    """A template that couldn't be compiled, and gets formatted the regular way."""
+
+    __slots__ = ("template", "formatter")
+
+    def __init__(self, template: str, formatter: Callable[..., str]) -> None:
+        """Save the template text and how to format it."""
+        self.template = template
+        self.formatter = formatter
+
+    def format(self, kwargs: Dict[str, Any]) -> str:
+        """Format the template from scratch."""
+        return self.formatter(self.template, **kwargs)
+
+
+class CompiledJinja2(CompiledTemplate):
+    """A jinja2 template that only gets parsed once."""
+
+    __slots__ = ("template",)
+
+    def __init__(self, template: str) -> None:
+        """Parse the jinja2 template."""
+        try:
+            from jinja2 import Template
+        except ImportError:
+            raise ImportError(
+                "jinja2 not installed, which is needed to use the jinja2_formatter. "
+                "Please install it with `pip install jinja2`."
+            )
+
+        self.template = Template(template)
+
+    def format(self, kwargs: Dict[str, Any]) -> str:
+        """Render the parsed jinja2 template."""
+        return self.template.render(**kwargs)
+
+
+def _compile_f_string(template: str) -> CompiledTemplate:
+    """Split an f-string template into segments.
+
+    Templates with attribute or index lookups, or with nested replacement fields in
+    their format specs, are left to the regular formatter instead.
+    """
+    segments: List[Segment] = []
+    for literal, name, format_spec, conversion in Formatter().parse(template):
+        if literal:
+            segments.append(literal)
+        if name is None:
+            continue
+        if (
+            not name.isidentifier()
+            or (format_spec and "{" in format_spec)
+            or (conversion and conversion not in _CONVERSIONS)
+        ):
+            return FallbackTemplate(template, DEFAULT_FORMATTER_MAPPING["f-string"])
+        segments.append((name, conversion or "", format_spec or ""))
+    return CompiledFString(segments)
+
+
+@lru_cache(maxsize=1024)
+def compile_template(template: str, template_format: str) -> CompiledTemplate:
+    """Compile template text, reusing earlier compilations of the same text."""
+    if template_format == "f-string":
+        return _compile_f_string(template)
+    elif template_format == "jinja2":
+        return CompiledJinja2(template)
+    else:
+        return FallbackTemplate(template, DEFAULT_FORMATTER_MAPPING[template_format])
@@ -1,13 +1,19 @@
 """Defines the Prefixed prompt template type."""
 from __future__ import annotations
 
-from typing import Optional
+from functools import partial
+from typing import Optional, Tuple
 
 from langchain.prompts.base import BasePromptTemplate
-from pydantic import BaseModel, Extra
+from pydantic import BaseModel, Extra, PrivateAttr
+
+from langchain_contrib.utils import BoundedCache
 
 from .chained import ChainedPromptTemplate
-from .schema import Templatable, into_template
+from .schema import Templatable, copy_template, into_template
+
+PREFIX_CACHE_SIZE = 128
+"""How many string prefixes each PrefixedTemplate remembers."""
 
 
 class PrefixedTemplate(BaseModel):
@@ -19,6 +25,11 @@ class PrefixedTemplate(BaseModel):
 
     template: BasePromptTemplate
 
+    _prefixed: BoundedCache[Tuple[str, str], ChainedPromptTemplate] = PrivateAttr(
+        default_factory=partial(BoundedCache, PREFIX_CACHE_SIZE)
+    )
+    """Templates previously built from string prefixes."""
+
     class Config:
         """Configuration for this pydantic object."""
 
@@ -44,6 +55,15 @@ class PrefixedTemplate(BaseModel):
         Returns:
             The final template with the prefix added if specified.
         """
-        if prefix:
+        if not prefix:
+            return self.template
+        if not isinstance(prefix, str):
             return ChainedPromptTemplate([prefix, self.template], joiner=joiner)
-        return self.template
+
+        key = (prefix, joiner)
+        cached = self._prefixed.get(key)
+        if cached is None:
+            cached = self._prefixed.put(
+                key, ChainedPromptTemplate([prefix, self.template], joiner=joiner)
+            )
+        return copy_template(cached)
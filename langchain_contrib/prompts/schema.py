@@ -1,21 +1,67 @@
 """Types useful for prompting."""
 
-from typing import Union
+from collections import ChainMap
+from functools import lru_cache
+from typing import Any, Dict, TypeVar, Union
 
 from langchain.prompts.base import BasePromptTemplate
 from langchain.prompts.chat import BaseMessagePromptTemplate
 from langchain.schema import BaseMessage
+from pydantic import BaseModel
 
 from .z_base import ZBasePromptTemplate, ZChatPromptTemplate, ZPromptTemplate
 
 Templatable = Union[str, BaseMessagePromptTemplate, BaseMessage, BasePromptTemplate]
 """Anything that can be converted directly into a BasePromptTemplate."""
 
+TEMPLATE_CACHE_SIZE = 512
+"""How many distinct template strings to keep parsed and validated."""
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def copy_template(template: M) -> M:
+    """Copy a cached template, so that the cached one stays unmodified.
+
+    Pydantic copies are shallow, so the copy gets its own versions of list and dict
+    fields such as input_variables. Nested templates are still shared.
+    """
+    update: Dict[str, Any] = {}
+    for name, value in template:
+        if isinstance(value, list):
+            update[name] = list(value)
+        elif isinstance(value, ChainMap):
+            # only the first map of a ChainMap ever gets written to
+            update[name] = ChainMap(dict(value.maps[0]), *value.maps[1:])
+        elif isinstance(value, dict):
+            update[name] = dict(value)
+    return template.copy(update=update)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _interned_template(template: str, template_format: str) -> ZPromptTemplate:
+    """Parse and validate a template string only once.
+
+    The cached template is only ever handed out through copy_template.
+    """
+    return ZPromptTemplate.from_template(template, template_format=template_format)
+
+
+def interned_template(
+    template: str, template_format: str = "f-string"
+) -> ZPromptTemplate:
+    """Get a ZPromptTemplate for this template string.
+
+    Repeated conversions of the same string are cache hits that only cost a copy of
+    the previously built template.
+    """
+    return copy_template(_interned_template(template, template_format))
+
 
 def into_template(templatable: Templatable) -> BasePromptTemplate:
     """Convert a Templatable into a proper BasePromptTemplate."""
     if isinstance(templatable, str):
-        return ZPromptTemplate.from_template(templatable)
+        return interned_template(templatable)
     elif isinstance(templatable, BaseMessagePromptTemplate) or isinstance(
         templatable, BaseMessage
     ):
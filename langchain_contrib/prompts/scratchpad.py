@@ -0,0 +1,132 @@
+"""Module defining an append-only agent scratchpad prompt value."""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain.schema import BaseMessage, HumanMessage, PromptValue
+from pydantic import Extra, PrivateAttr
+
+
+class _ScratchpadLog:
+    """Append-only storage shared between successive scratchpad values.
+
+    Every ScratchpadPromptValue is a view onto the first N steps of a log. Appending
+    to the newest view simply extends the log, so that the rendering of all previous
+    steps can be reused instead of joined together again.
+    """
+
+    __slots__ = ("joiner", "steps", "messages", "rendered", "rendered_length")
+
+    def __init__(self, joiner: str, steps: Optional[List[str]] = None) -> None:
+        self.joiner = joiner
+        self.steps: List[str] = steps or []
+        self.messages: List[BaseMessage] = []
+        self.rendered = ""
+        self.rendered_length = 0
+
+    def fork(self, length: int) -> _ScratchpadLog:
+        """Copy the first `length` steps into a new log."""
+        log = _ScratchpadLog(self.joiner, self.steps[:length])
+        log.messages = self.messages[:length]
+        if self.rendered_length <= length:
+            log.rendered = self.rendered
+            log.rendered_length = self.rendered_length
+        return log
+
+    def render(self, length: int) -> str:
+        """Render the first `length` steps, reusing the latest rendering if possible."""
+        if length < self.rendered_length:
+            # an older view that was never rendered itself
+            return self.joiner.join(self.steps[:length])
+
+        new_steps = self.steps[self.rendered_length : length]
+        if new_steps:
+            if self.rendered_length > 0:
+                new_steps.insert(0, self.rendered)
+            self.rendered = self.joiner.join(new_steps)
+            self.rendered_length = length
+        return self.rendered
+
+    def render_messages(self, length: int) -> List[BaseMessage]:
+        """Return one message per step, creating messages only for new steps."""
+        messages = self.messages
+        for step in self.steps[len(messages) : length]:
+            messages.append(HumanMessage(content=step))
+        return messages[:length]
+
+
+class ScratchpadPromptValue(PromptValue):
+    """An append-only agent scratchpad.
+
+    Each step of the agent is kept as a separate segment. Values are immutable, and
+    `append` returns a new value that shares storage with the old one, so rendering
+    the scratchpad on every agent iteration only costs as much as the newly appended
+    step.
+    """
+
+    joiner: str = ""
+    """How to join each step together when rendering to a string."""
+
+    _log: _ScratchpadLog = PrivateAttr()
+    _length: int = PrivateAttr(default=0)
+    _string: Optional[str] = PrivateAttr(default=None)
+
+    class Config:
+        """Configuration for this pydantic object."""
+
+        extra = Extra.forbid
+        allow_mutation = False
+
+    def __init__(self, joiner: str = "", steps: Iterable[str] = (), **kwargs: Any):
+        """Create a new scratchpad, optionally with some initial steps."""
+        super().__init__(joiner=joiner, **kwargs)
+        self._log = _ScratchpadLog(joiner, list(steps))
+        self._length = len(self._log.steps)
+
+    @property
+    def steps(self) -> List[str]:
+        """The steps recorded in this scratchpad so far."""
+        return self._log.steps[: self._length]
+
+    def dict(self, **kwargs: Any) -> Dict[str, Any]:
+        """Include the steps, which pydantic doesn't know about."""
+        return {**super().dict(**kwargs), "steps": self.steps}
+
+    def __eq__(self, other: Any) -> bool:
+        """Compare scratchpads by their joiner and steps."""
+        if isinstance(other, ScratchpadPromptValue):
+            return self.joiner == other.joiner and self.steps == other.steps
+        return super().__eq__(other)
+
+    def __repr_args__(self) -> Sequence[Tuple[Optional[str], Any]]:
+        """Show the steps along with the pydantic fields."""
+        return [*super().__repr_args__(), ("steps", self.steps)]
+
+    def __len__(self) -> int:
+        """Return the number of steps in this scratchpad."""
+        return self._length
+
+    def append(self, step: str) -> ScratchpadPromptValue:
+        """Return a new scratchpad with `step` added to the end of this one."""
+        log = self._log
+        if len(log.steps) != self._length:
+            # Another step has already been appended to this value. Branch off so
+            # that the other scratchpad remains unaffected.
+            log = log.fork(self._length)
+        log.steps.append(step)
+
+        result = ScratchpadPromptValue.construct(joiner=self.joiner)
+        result._log = log
+        result._length = self._length + 1
+        return result
+
+    def to_string(self) -> str:
+        """Return the scratchpad steps joined together."""
+        if self._string is None:
+            self._string = self._log.render(self._length)
+        return self._string
+
+    def to_messages(self) -> List[BaseMessage]:
+        """Return each scratchpad step as its own message."""
+        return self._log.render_messages(self._length)
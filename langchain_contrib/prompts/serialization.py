@@ -0,0 +1,219 @@
+"""Module for saving composite prompt templates and loading them back quickly.
+
+Templates get serialized into plain JSON-compatible data, with every pydantic object
+tagged by its registered class name. Functions such as choice serializers can't be
+stored directly, so they are referred to by their registered names instead.
+
+Loading skips pydantic validation entirely, so deeply nested templates don't pay for
+re-validating every one of their layers. Only load data that was produced by
+`serialize_template`.
+"""
+
+from __future__ import annotations
+
+import json
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, Type, Union
+
+from langchain.prompts.base import BasePromptTemplate
+from langchain.prompts.chat import (
+    AIMessagePromptTemplate,
+    ChatMessagePromptTemplate,
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    MessagesPlaceholder,
+    SystemMessagePromptTemplate,
+)
+from langchain.prompts.prompt import PromptTemplate
+from langchain.schema import AIMessage, ChatMessage, HumanMessage, SystemMessage
+from pydantic import BaseModel
+
+from .budget import estimate_tokens
+from .chained import ChainedPromptTemplate
+from .choice import BM25ChoiceRetriever, ChoicePromptTemplate
+from .choice.template import list_of_choices, oxford_comma_list, simple_join_choice
+from .z_base import (
+    DefaultsTo,
+    ZBasePromptTemplate,
+    ZChatPromptTemplate,
+    ZPromptTemplate,
+    ZStringPromptTemplate,
+)
+
+TYPE_KEY = "_type"
+"""Which key marks the type of a serialized object."""
+
+FUNCTION_TYPE = "function"
+"""Type tag used for serialized functions."""
+
+_CLASSES: Dict[str, Type[BaseModel]] = {}
+_CLASS_NAMES: Dict[Type[BaseModel], str] = {}
+_FUNCTIONS: Dict[str, Callable[..., Any]] = {}
+_FUNCTION_NAMES: Dict[Callable[..., Any], str] = {}
+
+
+def register_class(cls: Type[BaseModel], name: Optional[str] = None) -> None:
+    """Allow instances of a pydantic class to be serialized.
+
+    Args:
+        cls: The class to register.
+        name: The name to store the class under. Defaults to the class name.
+    """
+    name = name or cls.__name__
+    _CLASSES[name] = cls
+    _CLASS_NAMES[cls] = name
+
+
+def register_function(fn: Callable[..., Any], name: Optional[str] = None) -> None:
+    """Allow a function to be serialized by name.
+
+    Args:
+        fn: The function to register.
+        name: The name to store the function under. Defaults to the function name.
+    """
+    name = name or fn.__name__
+    _FUNCTIONS[name] = fn
+    _FUNCTION_NAMES[fn] = name
+
+
+def _is_plain_default(value: Any, default: Any) -> bool:
+    """Whether the value is the same as a simple default that can be left out.
+
+    Pydantic objects are never compared, because comparing them means converting
+    entire templates to dicts.
+    """
+    if default is None:
+        return value is None
+    elif isinstance(default, (bool, int, float, str)):
+        return isinstance(value, (bool, int, float, str)) and value == default
+    elif isinstance(default, (list, dict)) and not default:
+        return isinstance(value, (list, Mapping)) and not value
+    return False
+
+
+def _encode_model(model: BaseModel, path: str) -> Dict[str, Any]:
+    """Encode the fields of a pydantic object that differ from their defaults."""
+    cls = type(model)
+    if cls not in _CLASS_NAMES:
+        raise ValueError(f"Class {cls.__name__} at {path} is not registered")
+
+    result: Dict[str, Any] = {TYPE_KEY: _CLASS_NAMES[cls]}
+    for name, field in cls.__fields__.items():
+        value = getattr(model, name)
+        if not field.required and _is_plain_default(value, field.get_default()):
+            continue
+        result[name] = _encode(value, f"{path}.{name}")
+    return result
+
+
+def _encode(value: Any, path: str) -> Any:
+    """Turn a value into JSON-compatible data."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    elif isinstance(value, BaseModel):
+        return _encode_model(value, path)
+    elif isinstance(value, (list, tuple)):
+        return [_encode(v, f"{path}[{i}]") for i, v in enumerate(value)]
+    elif isinstance(value, Mapping):
+        if TYPE_KEY in value:
+            raise ValueError(f"Mapping at {path} uses reserved key '{TYPE_KEY}'")
+        return {k: _encode(v, f"{path}.{k}") for k, v in value.items()}
+    elif isinstance(value, partial):
+        encoded = _encode(value.func, path)
+        encoded["args"] = _encode(value.args, f"{path}.args")
+        encoded["kwargs"] = _encode(value.keywords, f"{path}.kwargs")
+        return encoded
+    elif callable(value) and value in _FUNCTION_NAMES:
+        return {TYPE_KEY: FUNCTION_TYPE, "name": _FUNCTION_NAMES[value]}
+    else:
+        raise ValueError(f"Cannot serialize {type(value).__name__} at {path}")
+
+
+def _decode(data: Any) -> Any:
+    """Turn JSON-compatible data back into the original value."""
+    if isinstance(data, list):
+        return [_decode(v) for v in data]
+    elif not isinstance(data, dict):
+        return data
+    elif TYPE_KEY not in data:
+        return {k: _decode(v) for k, v in data.items()}
+
+    type_name = data[TYPE_KEY]
+    if type_name == FUNCTION_TYPE:
+        fn = _FUNCTIONS[data["name"]]
+        if "args" in data or "kwargs" in data:
+            args = _decode(data.get("args", []))
+            return partial(fn, *args, **_decode(data.get("kwargs", {})))
+        return fn
+
+    if type_name not in _CLASSES:
+        raise ValueError(f"Unknown serialized type '{type_name}'")
+    fields = {k: _decode(v) for k, v in data.items() if k != TYPE_KEY}
+    # The data came from objects that were already validated once
+    return _CLASSES[type_name].construct(**fields)
+
+
+def serialize_template(template: BasePromptTemplate) -> Dict[str, Any]:
+    """Turn a prompt template into JSON-compatible data.
+
+    Raises:
+        ValueError: If the template contains values that can't be serialized, such as
+            unregistered functions or classes. The error mentions where in the template
+            the offending value is.
+    """
+    return _encode_model(template, "template")
+
+
+def deserialize_template(data: Dict[str, Any]) -> BasePromptTemplate:
+    """Load a prompt template back from the output of `serialize_template`."""
+    template = _decode(data)
+    assert isinstance(template, BasePromptTemplate), f"Not a template: {template}"
+    return template
+
+
+def save_template(template: BasePromptTemplate, path: Union[str, Path]) -> None:
+    """Save a prompt template to a JSON file."""
+    with open(path, "w") as f:
+        json.dump(serialize_template(template), f, indent=2)
+
+
+def load_template(path: Union[str, Path]) -> BasePromptTemplate:
+    """Load a prompt template from a JSON file."""
+    with open(path) as f:
+        return deserialize_template(json.load(f))
+
+
+_BUILTIN_CLASSES: List[Type[BaseModel]] = [
+    PromptTemplate,
+    ChatPromptTemplate,
+    SystemMessagePromptTemplate,
+    HumanMessagePromptTemplate,
+    AIMessagePromptTemplate,
+    ChatMessagePromptTemplate,
+    MessagesPlaceholder,
+    SystemMessage,
+    HumanMessage,
+    AIMessage,
+    ChatMessage,
+    ZBasePromptTemplate,
+    ZStringPromptTemplate,
+    ZPromptTemplate,
+    ZChatPromptTemplate,
+    ChainedPromptTemplate,
+    ChoicePromptTemplate,
+    DefaultsTo,
+    BM25ChoiceRetriever,
+]
+_BUILTIN_FUNCTIONS: List[Callable[..., Any]] = [
+    str,
+    simple_join_choice,
+    oxford_comma_list,
+    list_of_choices,
+    estimate_tokens,
+]
+
+for _cls in _BUILTIN_CLASSES:
+    register_class(_cls)
+for _fn in _BUILTIN_FUNCTIONS:
+    register_function(_fn)
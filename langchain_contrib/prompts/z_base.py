@@ -2,7 +2,24 @@
 
 from __future__ import annotations
 
-from typing import Any, Callable, Dict, Mapping, Optional, Union
+import asyncio
+import inspect
+from collections import ChainMap
+from functools import lru_cache
+from itertools import chain
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
 
 from langchain.prompts.base import (
     BasePromptTemplate,
@@ -13,7 +30,14 @@ from langchain.prompts.base import (
 from langchain.prompts.chat import ChatPromptTemplate
 from langchain.prompts.prompt import PromptTemplate
 from langchain.schema import PromptValue
-from pydantic import BaseModel, Extra, Field, root_validator
+from pydantic import BaseModel, Extra, Field, PrivateAttr, root_validator
+
+from langchain_contrib.utils import profiled
+
+from .compiled import compile_template
+
+VALIDATED_TEMPLATE_CACHE_SIZE = 1024
+"""How many (template, format, variables) combinations are remembered as valid."""
 
 
 class DefaultsTo(BaseModel):
@@ -32,6 +56,116 @@ class DefaultsTo(BaseModel):
         super().__init__(default_key=default_key, **kwargs)
 
 
+class PartialsPlan:
+    """A precomputed plan for resolving partial variables.
+
+    Plain values are merged in directly. Callables and DefaultsTo redirections are
+    ordered once, upon creation, so that every redirection is resolved after the
+    key it points to, even if that key is itself a redirection or a callable.
+    """
+
+    __slots__ = ("static", "steps", "memoize", "memo")
+
+    def __init__(self, partials: Mapping[str, Any], memoize: bool = False) -> None:
+        """Sort the partials into static values and dynamic resolution steps.
+
+        Raises:
+            ValueError: If the DefaultsTo redirections form a cycle.
+        """
+        self.static: Dict[str, Any] = {}
+        dynamic: Dict[str, Any] = {}
+        for key, value in partials.items():
+            if isinstance(value, DefaultsTo) or callable(value):
+                dynamic[key] = value
+            else:
+                self.static[key] = value
+
+        self.steps: List[Tuple[str, Any]] = []
+        self.memoize = memoize
+        self.memo: Dict[str, Any] = {}
+
+        # depth-first topological sort over the redirection edges
+        resolved: Dict[str, bool] = {}
+        for key in dynamic:
+            path: List[str] = []
+            while key in dynamic and not resolved.get(key, False):
+                if key in path:
+                    cycle = " -> ".join(path[path.index(key) :] + [key])
+                    raise ValueError(f"Partial variables default in a cycle: {cycle}")
+                path.append(key)
+                value = dynamic[key]
+                if not isinstance(value, DefaultsTo):
+                    break
+                key = value.default_key
+            for step_key in reversed(path):
+                resolved[step_key] = True
+                self.steps.append((step_key, dynamic[step_key]))
+
+    def resolve(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Merge the partials into the user-provided kwargs.
+
+        Partials are only evaluated if they aren't overridden by the user.
+        """
+        values = {**self.static, **kwargs}
+        for key, value in self.steps:
+            if key in kwargs:
+                continue
+            if isinstance(value, DefaultsTo):
+                values[key] = values[value.default_key]
+            elif self.memoize:
+                if key not in self.memo:
+                    self.memo[key] = _call_partial(key, value)
+                values[key] = self.memo[key]
+            else:
+                values[key] = _call_partial(key, value)
+        return values
+
+    async def aresolve(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Merge the partials into the user-provided kwargs, awaiting as needed.
+
+        Callable partials may return awaitables, which are all awaited concurrently
+        because callables never depend on any other partials.
+        """
+        values = {**self.static, **kwargs}
+        pending: Dict[str, Any] = {}
+        for key, value in self.steps:
+            if key in kwargs or isinstance(value, DefaultsTo):
+                continue
+            if self.memoize and key in self.memo:
+                values[key] = self.memo[key]
+                continue
+            result = value()
+            if inspect.isawaitable(result):
+                pending[key] = result
+            else:
+                values[key] = result
+
+        if pending:
+            results = await asyncio.gather(*pending.values())
+            values.update(zip(pending.keys(), results))
+        if self.memoize:
+            for key, value in self.steps:
+                if key not in kwargs and not isinstance(value, DefaultsTo):
+                    self.memo[key] = values[key]
+
+        for key, value in self.steps:
+            if key not in kwargs and isinstance(value, DefaultsTo):
+                values[key] = values[value.default_key]
+        return values
+
+
+def _call_partial(key: str, partial: Callable[[], Any]) -> Any:
+    """Call a partial outside of an event loop, rejecting awaitable results."""
+    result = partial()
+    if inspect.isawaitable(result):
+        if inspect.iscoroutine(result):
+            result.close()
+        raise TypeError(
+            f"Partial variable '{key}' is asynchronous. Use aformat_prompt instead."
+        )
+    return result
+
+
 class ZBasePromptTemplate(BasePromptTemplate):
     """A prompt template class that allows for arbitrary partials."""
 
@@ -46,6 +180,31 @@ class ZBasePromptTemplate(BasePromptTemplate):
     The BasePromptTemplate.format and format_prompt functions take in any arbitrary
     types, so why shouldn't partials as well?
     """
+    memoize_partials: bool = False
+    """Whether to only call callable partials once per template.
+
+    By default, callable partials are re-evaluated every time the template gets
+    formatted.
+    """
+
+    _partials_plan: Optional[PartialsPlan] = PrivateAttr(default=None)
+    _partials_plan_sources: Tuple[Any, ...] = PrivateAttr(default=())
+
+    def __init__(self, **kwargs: Any) -> None:
+        """Create the template and plan out how to resolve its partials."""
+        super().__init__(**kwargs)
+        self._get_partials_plan()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Pickle the template without its private caches."""
+        state = super().__getstate__()
+        state["__private_attribute_values__"] = {}
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """Unpickle the template, leaving caches to be rebuilt on demand."""
+        super().__setstate__(state)
+        self._init_private_attributes()
 
     @classmethod
     def from_base_template(
@@ -66,6 +225,7 @@ class ZBasePromptTemplate(BasePromptTemplate):
             "Either override _format_prompt or supply a base template"
         )
 
+    @profiled()
     def format_prompt(self, **kwargs: Any) -> PromptValue:
         """Format the prompt from the base prompt."""
         new_kwargs = self._merge_partial_and_user_variables(**kwargs)
@@ -74,6 +234,39 @@ class ZBasePromptTemplate(BasePromptTemplate):
         else:
             return self._format_prompt(**new_kwargs)
 
+    async def aformat_prompt(self, **kwargs: Any) -> PromptValue:
+        """Format the prompt, allowing for asynchronous partials.
+
+        Callable partials may be coroutine functions. Those that don't depend on each
+        other get awaited concurrently, including the ones of nested templates.
+        """
+        merged = await self._get_partials_plan().aresolve(kwargs)
+        return await self._aformat_merged_prompt(merged)
+
+    async def _aformat_merged_prompt(self, kwargs: Dict[str, Any]) -> PromptValue:
+        """Asynchronously format inputs that already have partials merged in."""
+        if self.base_template:
+            return await aformat_prompt(self.base_template, kwargs)
+        else:
+            return self._format_prompt(**kwargs)
+
+    @profiled()
+    def format_prompts(self, inputs: Sequence[Dict[str, Any]]) -> List[PromptValue]:
+        """Format the prompt for many different inputs in one go.
+
+        Equivalent to calling format_prompt on each input, except that per-template
+        work such as planning out the partials is only done once for the batch.
+        """
+        plan = self._get_partials_plan()
+        return self._format_merged_prompts([plan.resolve(kwargs) for kwargs in inputs])
+
+    def _format_merged_prompts(self, inputs: List[Dict[str, Any]]) -> List[PromptValue]:
+        """Format a batch of inputs that already have partials merged in."""
+        if self.base_template:
+            return format_prompts(self.base_template, inputs)
+        else:
+            return [self._format_prompt(**kwargs) for kwargs in inputs]
+
     @property
     def _prompt_type(self) -> str:
         """Return the type of prompt this is."""
@@ -84,57 +277,98 @@ class ZBasePromptTemplate(BasePromptTemplate):
 
     def partial(self, **kwargs: Union[str, Callable[[], str]]) -> ZBasePromptTemplate:
         """Return a partial of the prompt template."""
-        prompt_dict = self.__dict__.copy()
-        prompt_dict["input_variables"] = list(
-            set(self.input_variables).difference(kwargs)
-        )
-        prompt_dict["permissive_partial_variables"] = {
-            **self.permissive_partial_variables,
-            **kwargs,
-        }
-        return type(self)(**prompt_dict)
+        return self._with_partials(kwargs)
 
     def permissive_partial(self, **kwargs: Any) -> ZBasePromptTemplate:
         """Return a partial of the prompt template.
 
         Permissive version that allows for arbitrary input types.
         """
-        prompt_dict = self.__dict__.copy()
-        prompt_dict["input_variables"] = list(
-            set(self.input_variables).difference(kwargs)
+        return self._with_partials(kwargs)
+
+    def _with_partials(self, partials: Dict[str, Any]) -> ZBasePromptTemplate:
+        """Derive a partial template that shares everything else with this one.
+
+        The new partials are layered on top of the existing ones instead of being
+        copied into a fresh dict, and the derived template skips validation because
+        it only moves variables from input_variables into the partials.
+        """
+        parent_partials = self.permissive_partial_variables
+        if isinstance(parent_partials, ChainMap):
+            layered = ChainMap(partials, *parent_partials.maps)
+        else:
+            layered = ChainMap(partials, cast(Dict[str, Any], parent_partials))
+        input_variables = [v for v in self.input_variables if v not in partials]
+        result = self.copy(
+            update={
+                "input_variables": input_variables,
+                "permissive_partial_variables": layered,
+            }
         )
-        prompt_dict["permissive_partial_variables"] = {
-            **self.permissive_partial_variables,
-            **kwargs,
-        }
-        return type(self)(**prompt_dict)
-
-    def _prep_partials(self, kwargs: Dict[str, Any]) -> Any:
-        """Update the kwargs."""
-
-        def eval_partial(value: Any) -> Any:
-            if callable(value):
-                return value()
-            elif isinstance(value, DefaultsTo):
-                return kwargs[value.default_key]
-            else:
-                return value
+        result._get_partials_plan()
+        return result
 
-        return {k: eval_partial(v) for k, v in kwargs.items()}
+    def _get_partials_plan(self) -> PartialsPlan:
+        """Get the plan for resolving partials, creating it if necessary.
 
-    def _combined_kwargs(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
-        """Combine all kwargs into one dict."""
-        return {
-            **self.partial_variables,
-            **self.permissive_partial_variables,
-            **kwargs,
-        }
+        The plan is recreated whenever the partials themselves get replaced.
+        """
+        sources = (
+            self.partial_variables,
+            self.permissive_partial_variables,
+            self.memoize_partials,
+        )
+        if self._partials_plan is None or any(
+            a is not b for a, b in zip(sources, self._partials_plan_sources)
+        ):
+            self._partials_plan = PartialsPlan(
+                {**self.partial_variables, **self.permissive_partial_variables},
+                memoize=self.memoize_partials,
+            )
+            self._partials_plan_sources = sources
+        return self._partials_plan
 
     def _merge_partial_and_user_variables(self, **kwargs: Any) -> Dict[str, Any]:
         """Merge all partials, including permissive ones."""
-        combined_kwargs = self._combined_kwargs(kwargs)
-        processed_kwargs = self._prep_partials(combined_kwargs)
-        return processed_kwargs
+        return self._get_partials_plan().resolve(kwargs)
+
+
+@lru_cache(maxsize=VALIDATED_TEMPLATE_CACHE_SIZE)
+def _check_valid_template(
+    template: str, template_format: str, variables: FrozenSet[str]
+) -> None:
+    """Check that the template only uses the given variables.
+
+    Successful checks are memoized, so the same template text with the same variables
+    is only ever checked once.
+    """
+    check_valid_template(template, template_format, sorted(variables))
+
+
+def format_prompts(
+    template: BasePromptTemplate, inputs: Sequence[Dict[str, Any]]
+) -> List[PromptValue]:
+    """Format any template for a batch of inputs.
+
+    Uses the batched implementation for ZBasePromptTemplate's, and falls back to
+    formatting one input at a time otherwise.
+    """
+    if isinstance(template, ZBasePromptTemplate):
+        return template.format_prompts(inputs)
+    return [template.format_prompt(**kwargs) for kwargs in inputs]
+
+
+async def aformat_prompt(
+    template: BasePromptTemplate, kwargs: Dict[str, Any]
+) -> PromptValue:
+    """Format any template asynchronously.
+
+    Only ZBasePromptTemplate's can have asynchronous partials, so other templates
+    simply get formatted synchronously.
+    """
+    if isinstance(template, ZBasePromptTemplate):
+        return await template.aformat_prompt(**kwargs)
+    return template.format_prompt(**kwargs)
 
 
 class ZStringPromptTemplate(ZBasePromptTemplate, StringPromptTemplate):
@@ -151,21 +385,44 @@ class ZPromptTemplate(ZBasePromptTemplate, PromptTemplate):
         assert isinstance(result, ZPromptTemplate)
         return result
 
+    def _check_template(self) -> None:
+        """Check the template against the variables it currently has.
+
+        This runs on every format, so that copies with a different template or
+        variables get checked too. Checks are memoized by template text and
+        variables, so repeat checks only cost a cache lookup.
+        """
+        if self.validate_template:
+            variables = frozenset(
+                chain(
+                    self.input_variables,
+                    self.partial_variables,
+                    self.permissive_partial_variables,
+                )
+            )
+            _check_valid_template(self.template, self.template_format, variables)
+
     def _format_prompt(self, **kwargs: Any) -> PromptValue:
-        return StringPromptValue(text=PromptTemplate.format(self, **kwargs))
+        self._check_template()
+        compiled = compile_template(self.template, self.template_format)
+        return StringPromptValue.construct(text=compiled.format(kwargs))
+
+    def _format_merged_prompts(self, inputs: List[Dict[str, Any]]) -> List[PromptValue]:
+        self._check_template()
+        compiled = compile_template(self.template, self.template_format)
+        return [
+            StringPromptValue.construct(text=compiled.format(kwargs))
+            for kwargs in inputs
+        ]
 
     @root_validator()
     def template_is_valid(cls, values: Dict) -> Dict:
-        """Check that template and input variables are consistent."""
-        if values["validate_template"]:
-            all_inputs = (
-                values["input_variables"]
-                + list(values["partial_variables"])
-                + list(values["permissive_partial_variables"])
-            )
-            check_valid_template(
-                values["template"], values["template_format"], all_inputs
-            )
+        """Skip checking the template upon creation.
+
+        Overrides the PromptTemplate validator of the same name. Templates get
+        checked when they're first formatted instead, so that deriving partials and
+        wrappers doesn't re-check the same template text over and over again.
+        """
         return values
 
 
@@ -1,14 +1,20 @@
 """Utility code meant for development rather than agents."""
 
+from .caching import BoundedCache
 from .contexts import current_directory, temporary_file
-from .fvalues import f_join
+from .fvalues import FRope, f_join
 from .llm import call_llm
+from .profiling import PromptProfiler, profiled
 from .safe import safe_inputs
 
 __all__ = [
     "current_directory",
     "temporary_file",
     "f_join",
+    "FRope",
     "safe_inputs",
     "call_llm",
+    "PromptProfiler",
+    "profiled",
+    "BoundedCache",
 ]
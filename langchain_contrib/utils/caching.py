@@ -0,0 +1,29 @@
+"""Module for small caches that don't need any bookkeeping on lookups."""
+
+from __future__ import annotations
+
+from typing import Dict, TypeVar
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class BoundedCache(Dict[K, V]):
+    """A dict that forgets everything once it's full.
+
+    Clearing the whole cache is cruder than LRU eviction, but lookups stay as cheap
+    as plain dict lookups. This suits caches whose working set is usually far
+    smaller than the limit, which only exists to keep memory bounded.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        """Create an empty cache that holds at most max_size entries."""
+        super().__init__()
+        self.max_size = max_size
+
+    def put(self, key: K, value: V) -> V:
+        """Store the value, clearing the cache first if it's full."""
+        if len(self) >= self.max_size and key not in self:
+            self.clear()
+        self[key] = value
+        return value
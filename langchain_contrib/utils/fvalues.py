@@ -1,11 +1,92 @@
 """Module to join F-strings."""
 
-from typing import List, Union
+from __future__ import annotations
+
+from typing import List, Optional, Sequence, Tuple, Union
 
 from fvalues import F
 
+from .profiling import profiled
+
+Joinable = Union[str, F, "FRope"]
+"""Anything that can be joined together into an F-string."""
+
+
+def _fast_f(s: str, parts: Tuple[str, ...]) -> F:
+    """Create an F-string from parts that are already known to add up to it.
+
+    The F constructor checks that the parts add up to the string, which is an extra
+    full copy of the string that can be skipped when the parts were produced
+    alongside the string itself.
+    """
+    result = str.__new__(F, s)
+    result.parts = parts
+    return result
+
+
+class FRope:
+    """A lazy join of strings, F-strings, and other ropes.
+
+    Nesting ropes inside of each other is cheap because nothing gets copied until the
+    final string is needed. At that point the whole tree is materialized in one go,
+    and the result is cached.
+    """
+
+    __slots__ = ("joiner", "children", "_parts", "_f")
 
-def f_join(joiner: str, substrings: List[Union[str, F]]) -> F:
+    def __init__(self, joiner: str, children: Sequence[Joinable]) -> None:
+        """Create a new rope that joins the children together with the joiner."""
+        self.joiner = joiner
+        self.children = children
+        self._parts: Optional[Tuple[str, ...]] = None
+        self._f: Optional[F] = None
+
+    @property
+    def parts(self) -> Tuple[str, ...]:
+        """All the parts of the joined string.
+
+        Nested ropes are spliced in, while regular strings and F-strings are kept as
+        single parts, just like f_join does. Empty joiners are left out.
+        """
+        if self._parts is None:
+            parts: List[str] = []
+            # iterative depth-first traversal to handle deeply nested ropes
+            stack: List[Tuple[FRope, int]] = [(self, 0)]
+            while stack:
+                rope, index = stack.pop()
+                if index >= len(rope.children):
+                    continue
+                stack.append((rope, index + 1))
+                if index > 0 and rope.joiner != "":
+                    parts.append(rope.joiner)
+                child = rope.children[index]
+                if isinstance(child, FRope):
+                    if child._parts is not None:
+                        parts.extend(child._parts)
+                    else:
+                        stack.append((child, 0))
+                else:
+                    parts.append(child)
+            self._parts = tuple(parts)
+        return self._parts
+
+    def to_f(self) -> F:
+        """Materialize the rope into an F-string, only once."""
+        if self._f is None:
+            parts = self.parts
+            if not parts:
+                self._f = F("", parts=("",))
+            else:
+                self._f = _fast_f("".join(parts), parts)
+        return self._f
+
+    def __str__(self) -> str:
+        """Materialize the rope into a string."""
+        return self.to_f()
+
+
+@profiled("f_join")
+def f_join(joiner: str, substrings: Sequence[Joinable]) -> F:
     """Join strings together while preserving their original F and non-F status.
 
     This function exists to temporarily provide this functionality pending the merge of
@@ -13,24 +94,10 @@ def f_join(joiner: str, substrings: List[Union[str, F]]) -> F:
 
     Args:
         joiner: The string to join the substrings with.
-        substrings: The substrings to join. Can be either regular strings or F-strings.
+        substrings: The substrings to join. Can be either regular strings, F-strings,
+            or FRopes. Nested FRopes get spliced in without being materialized first.
 
     Returns:
         The joined string, with all original parts preserved.
     """
-    if substrings == []:
-        return F("")
-
-    joined = joiner.join(substrings)
-    parts = []
-    for substring in substrings:
-        parts.append(substring)
-
-        # if it's the empty string, we can just avoid polluting parts with it
-        if joiner != "":
-            parts.append(joiner)
-
-    if joiner != "":  # joiner should only exist in between parts
-        parts.pop()
-
-    return F(joined, parts=tuple(parts))
+    return FRope(joiner, substrings).to_f()
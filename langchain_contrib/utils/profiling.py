@@ -0,0 +1,164 @@
+"""Module for profiling where the time goes when rendering prompts.
+
+Profiling is opt-in. Outside of a `PromptProfiler` context, profiled functions only
+pay for a single context variable lookup.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+import tracemalloc
+from contextvars import ContextVar, Token
+from functools import wraps
+from types import TracebackType
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar, cast
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_current_node: ContextVar[Optional[ProfileNode]] = ContextVar(
+    "_current_node", default=None
+)
+
+
+class ProfileNode:
+    """Timing and allocation information for one profiled call."""
+
+    __slots__ = ("name", "seconds", "allocated", "children")
+
+    def __init__(self, name: str) -> None:
+        """Create an empty node for a call that hasn't finished yet."""
+        self.name = name
+        self.seconds = 0.0
+        self.allocated = 0
+        self.children: List[ProfileNode] = []
+
+    @property
+    def self_seconds(self) -> float:
+        """Time spent in this call itself, rather than in any profiled sub-calls."""
+        return max(0.0, self.seconds - sum(c.seconds for c in self.children))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert this node and all of its children into plain data."""
+        return {
+            "name": self.name,
+            "seconds": self.seconds,
+            "allocated_bytes": self.allocated,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+class PromptProfiler:
+    """Records a tree of profiled calls made while this context is active.
+
+    Example:
+        with PromptProfiler() as profiler:
+            template.format_prompt(**inputs)
+        print(profiler.to_collapsed())
+    """
+
+    def __init__(self, trace_memory: bool = False) -> None:
+        """Create a profiler.
+
+        Args:
+            trace_memory: Whether to also record how many bytes each call leaves
+                allocated, using tracemalloc. This slows down everything while the
+                profiler is active.
+        """
+        self.trace_memory = trace_memory
+        self.root = ProfileNode("root")
+        self._token: Optional[Token[Optional[ProfileNode]]] = None
+        self._started_tracing = False
+        self._start = 0.0
+
+    def __enter__(self) -> PromptProfiler:
+        """Start recording calls."""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._token = _current_node.set(self.root)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        """Stop recording calls."""
+        self.root.seconds += time.perf_counter() - self._start
+        assert self._token is not None
+        _current_node.reset(self._token)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @property
+    def calls(self) -> List[ProfileNode]:
+        """The top-level calls that were profiled, such as each format_prompt."""
+        return self.root.children
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the call tree as plain data."""
+        return self.root.to_dict()
+
+    def to_json(self, **kwargs: Any) -> str:
+        """Return the call tree as JSON."""
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_collapsed(self) -> str:
+        """Return the call tree in the collapsed stack format used by flame graphs.
+
+        Each line holds a semicolon-separated stack of calls, followed by the number
+        of microseconds spent in the last call of that stack.
+        """
+        lines: List[str] = []
+        stack = [(node, node.name) for node in reversed(self.root.children)]
+        while stack:
+            node, path = stack.pop()
+            lines.append(f"{path} {round(node.self_seconds * 1_000_000)}")
+            for child in reversed(node.children):
+                stack.append((child, f"{path};{child.name}"))
+        return "\n".join(lines)
+
+
+def _run_profiled(name: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Call the function while recording it as a child of the current node."""
+    parent = _current_node.get()
+    assert parent is not None
+    node = ProfileNode(name)
+    parent.children.append(node)
+    token = _current_node.set(node)
+    tracing = tracemalloc.is_tracing()
+    memory_before = tracemalloc.get_traced_memory()[0] if tracing else 0
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        node.seconds = time.perf_counter() - start
+        if tracing:
+            node.allocated = tracemalloc.get_traced_memory()[0] - memory_before
+        _current_node.reset(token)
+
+
+def profiled(name: Optional[str] = None) -> Callable[[F], F]:
+    """Mark a function to be recorded by active PromptProfiler's.
+
+    Args:
+        name: What to call the function in the call tree. Defaults to the name of the
+            class of the first argument followed by the function name, which suits
+            methods.
+    """
+
+    def decorator(fn: F) -> F:
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _current_node.get() is None:
+                return fn(*args, **kwargs)
+            label = name or f"{type(args[0]).__name__}.{fn.__name__}"
+            return _run_profiled(label, fn, *args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
@@ -0,0 +1,261 @@
+"""Test MRKL prompt formatting without calling any LLMs."""
+
+import pytest
+from langchain.prompts.base import StringPromptValue
+from langchain.schema import HumanMessage
+from langchain.tools import Tool
+
+from langchain_contrib.chains.mrkl.prompt import (
+    CHAT_MRKL_EMBEDDED_SCRATCHPAD,
+    MrklPromptTemplate,
+    get_chat_mrkl_prompt,
+    get_string_mrkl_prompt,
+    tool_description,
+)
+from langchain_contrib.prompts import (
+    ChainedPromptValue,
+    ChatSession,
+    ScratchpadPromptValue,
+    deserialize_template,
+    estimate_tokens,
+    serialize_template,
+)
+from langchain_contrib.prompts.choice import (
+    BM25ChoiceRetriever,
+    ChatChoicePrompt,
+    ChoicePromptTemplate,
+    StringChoicePrompt,
+)
+
+TOOLS = [
+    Tool(name="Search", func=lambda x: x, description="Look things up."),
+    Tool(name="Terminal", func=lambda x: x, description="Run commands."),
+]
+
+
+def test_string_scratchpad_value() -> None:
+    """Check that an incremental scratchpad gets embedded in the string prompt."""
+    template = get_string_mrkl_prompt().permissive_partial(tools=TOOLS)
+    scratchpad = ScratchpadPromptValue().append(" I should search.")
+    result = template.format(input="What is MRKL?", agent_scratchpad=scratchpad)
+    assert "Search: Look things up.\nTerminal: Run commands." in result
+    assert result.endswith("Question: What is MRKL?\nThought: I should search.")
+
+
+def test_chat_appended_scratchpad() -> None:
+    """Check that the scratchpad is appended when not embedded in the template."""
+    template = get_chat_mrkl_prompt().permissive_partial(tools=TOOLS)
+    scratchpad = ScratchpadPromptValue().append("Thought: search").append("Obs: ok")
+    messages = template.format_prompt(
+        input="What is MRKL?", agent_scratchpad=scratchpad
+    ).to_messages()
+    assert messages[1:] == [
+        HumanMessage(content="What is MRKL?"),
+        HumanMessage(content="Thought: search"),
+        HumanMessage(content="Obs: ok"),
+    ]
+
+
+def test_batch_formatting() -> None:
+    """Check that a batch of MRKL prompts matches formatting them one by one."""
+    template = get_chat_mrkl_prompt().permissive_partial(tools=TOOLS)
+    inputs = [
+        {"input": "What is MRKL?", "agent_scratchpad": "Thought: search"},
+        {"input": "What is ReAct?", "agent_scratchpad": ""},
+    ]
+    batch = template.format_prompts([dict(kwargs) for kwargs in inputs])
+    assert [p.to_messages() for p in batch] == [
+        template.format_prompt(**kwargs).to_messages() for kwargs in inputs
+    ]
+
+
+def test_tool_retrieval() -> None:
+    """Check that tool names and descriptions are drawn from the same shortlist."""
+    template = MrklPromptTemplate.from_template(
+        "{tool_descriptions}\nPick one of [{tools}].\n{input}",
+        tool_retriever=BM25ChoiceRetriever(k=1, document_serializer=tool_description),
+    ).permissive_partial(tools=TOOLS)
+    result = template.format(input="run the ls command", agent_scratchpad="")
+    assert result.startswith("Terminal: Run commands.\nPick one of [Terminal].")
+
+
+def test_tool_retrieval_default_serializer() -> None:
+    """Check that tool retrieval searches tool descriptions by default."""
+    retriever = BM25ChoiceRetriever(k=1)
+    template = MrklPromptTemplate.from_template(
+        "{tool_descriptions}\nPick one of [{tools}].\n{input}",
+        tool_retriever=retriever,
+    ).permissive_partial(tools=TOOLS)
+    result = template.format(input="run the ls command", agent_scratchpad="")
+    assert result.startswith("Terminal: Run commands.\nPick one of [Terminal].")
+    assert retriever.document_serializer is str
+    descriptions_template = template.base_template
+    assert isinstance(descriptions_template, ChoicePromptTemplate)
+    assert descriptions_template.choice_retriever is not None
+    assert (
+        descriptions_template.choice_retriever.document_serializer is tool_description
+    )
+
+
+def test_serialization_round_trip() -> None:
+    """Check that a MRKL template can be stored before tools are given to it."""
+    template = deserialize_template(serialize_template(get_chat_mrkl_prompt()))
+    assert isinstance(template, MrklPromptTemplate)
+    messages = (
+        template.permissive_partial(tools=TOOLS)
+        .format_prompt(input="What is MRKL?", agent_scratchpad="Thought:")
+        .to_messages()
+    )
+    assert messages == (
+        get_chat_mrkl_prompt()
+        .permissive_partial(tools=TOOLS)
+        .format_prompt(input="What is MRKL?", agent_scratchpad="Thought:")
+        .to_messages()
+    )
+
+
+def test_token_budget() -> None:
+    """Check that the oldest scratchpad steps get elided to stay within budget."""
+    template = get_string_mrkl_prompt().permissive_partial(tools=TOOLS)
+    base_tokens = estimate_tokens(template.format(input="Hi", agent_scratchpad=""))
+    budgeted = template.copy(update={"token_budget": base_tokens + 20})
+    assert isinstance(budgeted, MrklPromptTemplate)
+    scratchpad = ScratchpadPromptValue()
+    for i in range(5):
+        scratchpad = scratchpad.append(f" Step {i} of the agent.\nThought:")
+
+    value, report = budgeted.budgeted_format_prompt(
+        input="Hi", agent_scratchpad=scratchpad
+    )
+    assert report.within_budget
+    assert report.dropped_steps == [0, 1, 2, 3]
+    assert value.to_string().endswith(
+        "Thought: (4 earlier steps omitted)\n Step 4 of the agent.\nThought:"
+    )
+    assert budgeted.format(input="Hi", agent_scratchpad=scratchpad) == (
+        value.to_string()
+    )
+
+
+def test_token_budget_unneeded() -> None:
+    """Check that nothing gets dropped when the prompt already fits."""
+    template = get_chat_mrkl_prompt().permissive_partial(tools=TOOLS)
+    budgeted = template.copy(update={"token_budget": 10_000})
+    assert isinstance(budgeted, MrklPromptTemplate)
+    scratchpad = ScratchpadPromptValue().append("Thought: search")
+    value, report = budgeted.budgeted_format_prompt(
+        input="Hi", agent_scratchpad=scratchpad
+    )
+    assert report.dropped_steps == []
+    assert value.to_messages()[-1] == HumanMessage(content="Thought: search")
+
+
+def test_stable_prefix() -> None:
+    """Check that an appended scratchpad leaves the prefix the same every step."""
+    template = get_chat_mrkl_prompt().permissive_partial(tools=TOOLS)
+    scratchpad = ScratchpadPromptValue().append("Thought: search")
+    first = template.format_prompt(input="Hi", agent_scratchpad=scratchpad)
+    second = template.format_prompt(
+        input="Hi", agent_scratchpad=scratchpad.append("Observation: found it")
+    )
+    assert isinstance(first, ChainedPromptValue)
+    assert isinstance(second, ChainedPromptValue)
+    assert first.prefix_hash() == second.prefix_hash()
+    assert second.to_string().startswith(first.static_prefix())
+    assert first.static_messages() == second.to_messages()[:2]
+
+
+@pytest.mark.parametrize(
+    "base,prefix_end",
+    [(get_string_mrkl_prompt(), "Thought:"), (CHAT_MRKL_EMBEDDED_SCRATCHPAD, "Hi\n\n")],
+)
+def test_stable_prefix_embedded(base: MrklPromptTemplate, prefix_end: str) -> None:
+    """Check that the default templates with embedded scratchpads mark a prefix."""
+    template = base.permissive_partial(tools=TOOLS)
+    scratchpad = ScratchpadPromptValue().append(" search")
+    first = template.format_prompt(input="Hi", agent_scratchpad=scratchpad)
+    second = template.format_prompt(
+        input="Hi", agent_scratchpad=scratchpad.append("\nObservation: found it")
+    )
+    assert isinstance(first, (StringChoicePrompt, ChatChoicePrompt))
+    assert isinstance(second, (StringChoicePrompt, ChatChoicePrompt))
+    assert len(first.choices) == len(TOOLS)
+    assert first.static_prefix().endswith(prefix_end)
+    assert first.prefix_hash() == second.prefix_hash()
+    assert second.to_string() == (
+        first.static_prefix() + " search\nObservation: found it"
+    )
+    assert first.static_messages() == second.to_messages()[:-1]
+
+
+def test_embedded_value_type() -> None:
+    """Check that marking the static prefix keeps the choice prompt value type."""
+    template = get_string_mrkl_prompt().permissive_partial(tools=TOOLS)
+    value = template.format_prompt(input="Hi", agent_scratchpad=" search")
+    assert isinstance(value, StringPromptValue)
+    assert isinstance(value, StringChoicePrompt)
+    assert value.text == value.to_string()
+    assert value.choices == [tool_description(tool) for tool in TOOLS]
+    assert value.static_prefix() + " search" == value.text
+
+
+def test_chat_delta() -> None:
+    """Check that each agent iteration only reports its new scratchpad step."""
+    template = get_chat_mrkl_prompt().permissive_partial(tools=TOOLS)
+    assert isinstance(template, MrklPromptTemplate)
+    session = ChatSession()
+    scratchpad = ScratchpadPromptValue().append("Thought: search")
+    first = template.format_chat_delta(session, input="Hi", agent_scratchpad=scratchpad)
+    assert len(first.new_messages) == 3
+
+    scratchpad = scratchpad.append("Observation: found it")
+    second = template.format_chat_delta(
+        session, input="Hi", agent_scratchpad=scratchpad
+    )
+    assert second.new_messages == [HumanMessage(content="Observation: found it")]
+    assert second.to_messages()[0] is first.to_messages()[0]
+
+
+async def test_async_formatting() -> None:
+    """Check that async tool lookups are awaited when formatting asynchronously."""
+
+    async def get_tools() -> list:
+        return TOOLS
+
+    template = get_chat_mrkl_prompt().permissive_partial(tools=get_tools)
+    value = await template.aformat_prompt(input="Hi", agent_scratchpad="Thought:")
+    assert value.to_messages() == (
+        get_chat_mrkl_prompt()
+        .permissive_partial(tools=TOOLS)
+        .format_prompt(input="Hi", agent_scratchpad="Thought:")
+        .to_messages()
+    )
+
+
+async def test_async_token_budget() -> None:
+    """Check that async partials can be combined with a token budget."""
+
+    async def get_tools() -> list:
+        return TOOLS
+
+    template = get_string_mrkl_prompt().permissive_partial(tools=TOOLS)
+    base_tokens = estimate_tokens(template.format(input="Hi", agent_scratchpad=""))
+    budgeted = template.copy(update={"token_budget": base_tokens + 20})
+    assert isinstance(budgeted, MrklPromptTemplate)
+    scratchpad = ScratchpadPromptValue()
+    for i in range(5):
+        scratchpad = scratchpad.append(f" Step {i} of the agent.\nThought:")
+    expected, expected_report = budgeted.budgeted_format_prompt(
+        input="Hi", agent_scratchpad=scratchpad
+    )
+
+    async_budgeted = budgeted.permissive_partial(tools=get_tools)
+    assert isinstance(async_budgeted, MrklPromptTemplate)
+    value = await async_budgeted.aformat_prompt(input="Hi", agent_scratchpad=scratchpad)
+    assert value.to_string() == expected.to_string()
+    value, report = await async_budgeted.abudgeted_format_prompt(
+        input="Hi", agent_scratchpad=scratchpad
+    )
+    assert value.to_string() == expected.to_string()
+    assert report == expected_report
+    assert report.dropped_steps == [0, 1, 2, 3]
@@ -1,12 +1,25 @@
 """Test that the ChoiceChain can successfully make choices."""
 
-from typing import Dict
+import asyncio
+import json
+import threading
+from typing import Any, Dict, List, Optional
 
 import pytest
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForChainRun,
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.chains.base import Chain
+from langchain.chains.llm import LLMChain
+from langchain.prompts import PromptTemplate
+from langchain.schema import LLMResult
 from langchain.tools.python.tool import PythonREPLTool
 
 from langchain_contrib.chains import ChoiceChain, ToolChain
 from langchain_contrib.chains.testing import FakeChain, FakePicker
+from langchain_contrib.llms.testing import FakeLLM
 from langchain_contrib.tools import TerminalTool, ZBaseTool
 
 
@@ -99,6 +112,22 @@ def test_separated_io() -> None:
     assert choices.chosen_outputs(second_results) == {"b": "two"}
 
 
+def test_io_info_json() -> None:
+    """Test that IO info is emitted as plain JSON strings."""
+    choices = ChoiceChain(
+        choice_picker=FakeChain(output={"choice": "first", "a_input": "foo"}),
+        choices={
+            "first": FakeChain(expected_inputs=["a_input"], output={"a": "one"}),
+        },
+        emit_io_info=True,
+    )
+    results = choices({}, return_only_outputs=True)
+    assert type(results["choice_inputs"]) is str
+    assert json.loads(json.dumps(results)) == results
+    assert results["choice_inputs"] == json.dumps({"a_input": "foo"})
+    assert choices.chosen_outputs({"choice_outputs": '{"a": "one"}'}) == {"a": "one"}
+
+
 def test_extra_arguments() -> None:
     """Test that the choice chain will complain about extra arguments to a choice."""
     choices = ChoiceChain(
@@ -112,6 +141,236 @@ def test_extra_arguments() -> None:
         choices({})
 
 
+class AsyncFakeChain(FakeChain):
+    """Fake chain with native async support that records the thread it ran on."""
+
+    thread_ids: List[int] = []
+
+    async def _acall(
+        self,
+        inputs: Dict[str, str],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, str]:
+        """Return the output dict after yielding to the event loop."""
+        await asyncio.sleep(0)
+        self.thread_ids.append(threading.get_ident())
+        return self._call(inputs)
+
+
+async def test_async_choices() -> None:
+    """Test that the choice chain awaits async choices on the event loop thread."""
+    first = AsyncFakeChain(output={"a": "one"})
+    choices = ChoiceChain(
+        choice_picker=FakePicker(),
+        choices={"first": first, "second": FakeChain(output={"b": "two"})},
+    )
+    assert await choices.acall({"c": "first"}, return_only_outputs=True) == {
+        "choice": "first",
+        "a": "one",
+    }
+    assert first.thread_ids == [threading.get_ident()]
+
+
+async def test_async_offloads_sync_chains() -> None:
+    """Test that sync-only chains get run off of the event loop thread."""
+    loop_thread = threading.get_ident()
+    chain_threads = []
+
+    def record_thread(inputs: Dict[str, str]) -> Dict[str, str]:
+        chain_threads.append(threading.get_ident())
+        return {"b": inputs["b_input"]}
+
+    choices = ChoiceChain(
+        choice_picker=FakeChain(output={"choice": "second", "b_input": "bar"}),
+        choices={
+            "first": FakeChain(output={"a": "one"}),
+            "second": FakeChain(
+                expected_inputs=["b_input"], inputs_to_outputs=record_thread
+            ),
+        },
+        emit_io_info=True,
+    )
+    results = await asyncio.gather(*(choices.acall({}) for _ in range(3)))
+    for result in results:
+        assert result["b"] == "bar"
+        assert choices.chosen_inputs(result) == {"b_input": "bar"}
+    assert len(chain_threads) == 3
+    assert loop_thread not in chain_threads
+
+
+async def test_async_invalid_choice() -> None:
+    """Test the async choice chain complains about choices that don't exist."""
+    choices = ChoiceChain(
+        choice_picker=FakeChain(output={"choice": "third"}),
+        choices={"first": FakeChain(), "second": FakeChain()},
+    )
+    with pytest.raises(KeyError):
+        await choices.acall({})
+
+
+class CountingLLM(FakeLLM):
+    """Fake LLM that keeps track of how many prompts each generate call got."""
+
+    batch_sizes: List[int] = []
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+    ) -> LLMResult:
+        """Record the batch size before generating as usual."""
+        self.batch_sizes.append(len(prompts))
+        return super()._generate(prompts, stop, run_manager)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+    ) -> LLMResult:
+        """Generate synchronously, since FakeLLM has no async support."""
+        return self._generate(prompts, stop)
+
+
+def batch_chain() -> ChoiceChain:
+    """Create a ChoiceChain with an LLM picker and a mix of choices."""
+    picker = LLMChain(
+        llm=CountingLLM(mapped_responses={"a": "first", "b": "second"}),
+        prompt=PromptTemplate.from_template("{c}"),
+        output_key="choice",
+    )
+    first = LLMChain(
+        llm=CountingLLM(mapped_responses={"a": "one"}),
+        prompt=PromptTemplate.from_template("{c}"),
+        output_key="a",
+    )
+    second = FakeChain(expected_inputs=["c"], inputs_to_outputs=lambda i: {"b": "two"})
+    return ChoiceChain(choice_picker=picker, choices={"first": first, "second": second})
+
+
+def check_batch_results(chain: ChoiceChain, results: List[Dict[str, str]]) -> None:
+    """Check that batch_chain results are in order and were batched."""
+    assert results == [
+        {"c": "a", "choice": "first", "a": "one"},
+        {"c": "b", "choice": "second", "b": "two"},
+        {"c": "a", "choice": "first", "a": "one"},
+        {"c": "b", "choice": "second", "b": "two"},
+    ]
+    picker = chain.choice_picker
+    first = chain.choices["first"]
+    assert isinstance(picker, LLMChain) and isinstance(first, LLMChain)
+    assert isinstance(picker.llm, CountingLLM) and isinstance(first.llm, CountingLLM)
+    assert picker.llm.batch_sizes == [4]
+    assert first.llm.batch_sizes == [2]
+
+
+def test_batch() -> None:
+    """Test that batches get picked together and grouped by choice."""
+    chain = batch_chain()
+    inputs = [{"c": "a"}, {"c": "b"}, {"c": "a"}, {"c": "b"}]
+    check_batch_results(chain, chain.batch(inputs, max_concurrency=2))
+
+
+async def test_abatch() -> None:
+    """Test that async batches get picked together and grouped by choice."""
+    chain = batch_chain()
+    inputs = [{"c": "a"}, {"c": "b"}, {"c": "a"}, {"c": "b"}]
+    check_batch_results(chain, await chain.abatch(inputs, max_concurrency=2))
+
+
+def test_batch_bounded_concurrency() -> None:
+    """Test that batches don't run more sync chains at once than allowed."""
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+
+    def track(inputs: Dict[str, str]) -> Dict[str, str]:
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        threading.Event().wait(0.01)
+        with lock:
+            running[0] -= 1
+        return {"a": inputs["c"]}
+
+    chain = ChoiceChain(
+        choice_picker=FakeChain(expected_inputs=["c"], output={"choice": "first"}),
+        choices={"first": FakeChain(expected_inputs=["c"], inputs_to_outputs=track)},
+    )
+    results = chain.batch([{"c": str(i)} for i in range(8)], max_concurrency=2)
+    assert [r["a"] for r in results] == [str(i) for i in range(8)]
+    assert 1 <= max_running[0] <= 2
+    assert chain.batch([]) == []
+
+
+def test_routing_plan() -> None:
+    """Test that key sets get computed once, even for unvalidated chains."""
+    kwargs: Dict[str, Any] = dict(
+        choice_picker=FakeChain(output={"choice": "first", "note": "x", "a_in": "1"}),
+        choices={
+            "first": FakeChain(expected_inputs=["a_in", "c"], output={"a": "one"}),
+            "second": FakeChain(output={"b": "two"}),
+        },
+        ignore_keys=["note"],
+    )
+    for chain in [ChoiceChain(**kwargs), ChoiceChain.construct(**kwargs)]:
+        assert chain._get_plan() is chain._get_plan()
+        chain.output_keys.append("extra")
+        assert "extra" not in chain.output_keys
+        assert set(chain.output_keys) == {
+            "choice",
+            "choice_inputs",
+            "choice_outputs",
+            "note",
+            "a_in",
+            "a",
+            "b",
+        }
+        assert chain({"c": "3", "d": "4"}, return_only_outputs=True) == {
+            "choice": "first",
+            "note": "x",
+            "a_in": "1",
+            "a": "one",
+        }
+
+
+def test_routing_plan_updates() -> None:
+    """Test that the key sets follow changes to the choices and ignored keys."""
+    chain = ChoiceChain(
+        choice_picker=FakeChain(output={"choice": "second", "note": "x"}),
+        choices={"first": FakeChain(output={"a": "one"})},
+        ignore_keys=["note"],
+    )
+    choices: Dict[str, Chain] = chain.choices  # type: ignore
+    assert "b" not in chain.output_keys
+    choices["second"] = FakeChain(output={"b": "two"})
+    assert "b" in chain.output_keys
+    assert chain({}, return_only_outputs=True) == {
+        "choice": "second",
+        "note": "x",
+        "b": "two",
+    }
+
+    choices["second"] = FakeChain(expected_inputs=["note"], output={"c": "3"})
+    chain.ignore_keys = []
+    assert "c" in chain.output_keys
+    assert chain({}, return_only_outputs=True)["c"] == "3"
+
+    # pydantic drops the callback fields of copied chains, so pass them all anew
+    copied = chain.copy(
+        update={
+            "choice_picker": FakeChain(output={"choice": "second"}),
+            "choices": {"second": FakeChain(output={"d": "4"})},
+            "callbacks": None,
+            "callback_manager": None,
+        }
+    )
+    assert "d" in copied.output_keys and "c" not in copied.output_keys
+    assert copied({}, return_only_outputs=True)["d"] == "4"
+    assert chain({}, return_only_outputs=True)["c"] == "3"
+
+
 def test_tools() -> None:
     """Test that the ChoiceChain can be loaded and run from tools."""
     chain = ChoiceChain.from_tools(
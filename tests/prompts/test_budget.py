@@ -0,0 +1,34 @@
+"""Tests for fitting prompts within token budgets."""
+
+from langchain_contrib.prompts.budget import estimate_tokens, fit_steps, truncate_text
+
+
+def test_estimate_tokens() -> None:
+    """Check the character-based token estimate."""
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+
+
+def test_drop_oldest_steps() -> None:
+    """Check that the oldest steps are dropped first, with a note in their place."""
+    steps = ["a" * 40, "b" * 40, "c" * 40]
+    kept, report = fit_steps(steps, budget=15, elision_note="<{count}>")
+    assert kept == ["<2>", "c" * 40]
+    assert report.dropped_steps == [0, 1]
+    assert report.dropped_tokens == 20
+    assert report.tokens == 11
+    assert report.within_budget
+
+
+def test_truncate_long_steps() -> None:
+    """Check that long steps get truncated before any steps are dropped."""
+    steps = ["a" * 8, "b" * 400]
+    kept, report = fit_steps(steps, budget=15, max_step_tokens=10)
+    assert kept == [
+        "a" * 8,
+        truncate_text("b" * 400, 10, estimate_tokens, " [truncated]"),
+    ]
+    assert kept[1].endswith(" [truncated]")
+    assert report.dropped_steps == []
+    assert report.truncated_steps == [1]
@@ -1,5 +1,7 @@
 """Tests for chained prompt templates."""
 
+import pickle
+
 import pytest
 from langchain.prompts.base import StringPromptValue
 from langchain.prompts.chat import (
@@ -191,3 +193,159 @@ def test_prompt_value_chaining_to_message() -> None:
             HumanMessage(content="What is langchain-contrib?", additional_kwargs={}),
         ]
     ).to_messages()
+
+
+def test_prompt_value_rendered_once() -> None:
+    """Test that chained prompt values only render their subvalues once."""
+    value = ChainedPromptValue(
+        joiner=" ", subvalues=[StringPromptValue(text="a"), StringPromptValue(text="b")]
+    )
+    first = value.to_string()
+    assert first == "a b"
+    assert value.to_string() is first
+    assert value.to_messages() == value.to_messages()
+
+
+def test_prompt_value_flattening() -> None:
+    """Test that nested chained prompt values with the same joiner are flattened."""
+    inner = ChainedPromptValue(
+        joiner=" ", subvalues=[StringPromptValue(text="a"), StringPromptValue(text="b")]
+    )
+    other = ChainedPromptValue(
+        joiner="-", subvalues=[StringPromptValue(text="c"), StringPromptValue(text="d")]
+    )
+    outer = ChainedPromptValue(joiner=" ", subvalues=[inner, other])
+    assert len(outer.subvalues) == 3
+    assert outer.to_string() == "a b c-d"
+    assert [m.content for m in outer.to_messages()] == ["a", "b", "c", "d"]
+
+
+def test_empty_prompt_value_not_flattened() -> None:
+    """Test that an empty nested chain still takes up a joiner."""
+    value = ChainedPromptValue(
+        joiner="\n",
+        subvalues=[StringPromptValue(text="1"), ChainedPromptValue(subvalues=[])],
+    )
+    assert len(value.subvalues) == 2
+    assert value.to_string() == "1\n"
+    assert ChainedPromptValue.from_subvalues("\n", value.subvalues).to_string() == (
+        "1\n"
+    )
+
+
+def test_prompt_value_copy_not_stale() -> None:
+    """Test that copies of a rendered value render their own updated fields."""
+    value = ChainedPromptValue(
+        joiner=" ",
+        subvalues=[StringPromptValue(text="a"), StringPromptValue(text="a")],
+        static_count=1,
+    )
+    assert value.to_string() == "a a"
+    assert value.static_prefix() == "a "
+    copied = value.copy(update={"joiner": "-"})
+    assert copied.to_string() == "a-a"
+    assert copied.static_prefix() == "a-"
+    assert value.to_string() == "a a"
+
+
+def test_batch_formatting() -> None:
+    """Test that a batch of inputs formats the same as individual inputs."""
+    template = ChainedPromptTemplate(
+        ["You see a {creature}.", "It {action}."], joiner=" "
+    ).permissive_partial(action="waves")
+    inputs = [{"creature": "grue"}, {"creature": "dragon"}]
+    assert [p.to_string() for p in template.format_prompts(inputs)] == [
+        "You see a grue. It waves.",
+        "You see a dragon. It waves.",
+    ]
+    with pytest.raises(KeyError):
+        template.format_prompts([{"creature": "grue", "color": "green"}])
+
+
+def test_empty_batch_formatting() -> None:
+    """Test that a template without subprompts formats one value per input."""
+    template = ChainedPromptTemplate([])
+    assert [p.to_string() for p in template.format_prompts([{}, {}])] == ["", ""]
+
+
+def test_input_variable_routing() -> None:
+    """Test that each subprompt only receives its own input variables."""
+    template = ChainedPromptTemplate(
+        ["{a} and {b}.", "{b} or {c}.", "Just text."], joiner=" "
+    )
+    assert template.input_variables == ["a", "b", "c"]
+    assert template.format(a=1, b=2, c=3) == "1 and 2. 2 or 3. Just text."
+    with pytest.raises(KeyError):
+        template.format(a=1, b=2, c=3, d=4)
+
+
+def test_input_variable_routing_updates() -> None:
+    """Test that routing follows subprompts that get replaced later on."""
+    template = ChainedPromptTemplate(["{a} and {b}.", "Just text."], joiner=" ")
+    assert template.format(a=1, b=2) == "1 and 2. Just text."
+    template.subprompts[1] = PromptTemplate.from_template("{b} or {c}.")
+    template.input_variables = ["a", "b", "c"]
+    assert template.format(a=1, b=2, c=3) == "1 and 2. 2 or 3."
+
+    copied = template.copy(update={"subprompts": [template.subprompts[1]]})
+    assert copied.format(b=2, c=3) == "2 or 3."
+
+
+def test_static_prefix() -> None:
+    """Test that the static prefix is an exact prefix of the full string."""
+    value = ChainedPromptValue(
+        joiner="\n",
+        subvalues=[
+            StringPromptValue(text="Instructions"),
+            ChainedPromptValue(
+                joiner="\n",
+                subvalues=[
+                    StringPromptValue(text="Tools"),
+                    StringPromptValue(text="Examples"),
+                ],
+            ),
+            StringPromptValue(text="Scratchpad"),
+        ],
+        static_count=2,
+    )
+    assert value.static_count == 3
+    assert value.static_prefix() == "Instructions\nTools\nExamples\n"
+    assert value.to_string().startswith(value.static_prefix())
+    assert value.static_messages() == [
+        HumanMessage(content="Instructions"),
+        HumanMessage(content="Tools"),
+        HumanMessage(content="Examples"),
+    ]
+
+
+def test_prefix_hash() -> None:
+    """Test that the prefix hash only depends on the static subvalues."""
+    first = ChainedPromptValue(
+        subvalues=[StringPromptValue(text="A"), StringPromptValue(text="B")],
+        static_count=1,
+    )
+    second = ChainedPromptValue(
+        subvalues=[StringPromptValue(text="A"), StringPromptValue(text="C")],
+        static_count=1,
+    )
+    assert first.prefix_hash() == second.prefix_hash()
+    assert first.prefix_hash() != ChainedPromptValue(subvalues=[]).prefix_hash()
+
+
+def test_formatted_values_are_pydantic() -> None:
+    """Test that formatted chains work like pydantic ChainedPromptValues."""
+    value = ChainedPromptTemplate(["Hi", "{name}"], joiner=" ").format_prompt(
+        name="Bob"
+    )
+    expected = ChainedPromptValue(
+        joiner=" ",
+        subvalues=[StringPromptValue(text="Hi"), StringPromptValue(text="Bob")],
+    )
+    assert type(value) is ChainedPromptValue
+    assert value == expected
+    assert value.copy() == expected
+    assert value.dict() == expected.dict()
+    assert pickle.loads(pickle.dumps(value)).to_string() == "Hi Bob"
+
+    nested = ChainedPromptValue(joiner="\n", subvalues=[value])
+    assert nested.dict()["subvalues"][0] == expected.dict()
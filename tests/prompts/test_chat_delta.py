@@ -0,0 +1,46 @@
+"""Tests for incremental chat prompt values."""
+
+from langchain.prompts.chat import ChatPromptValue
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+from langchain_contrib.prompts import ChatSession
+
+
+def test_new_messages() -> None:
+    """Test that only the new tail of the conversation gets reported."""
+    session = ChatSession()
+    history = [SystemMessage(content="Be nice."), HumanMessage(content="Hi")]
+    first = session.delta(ChatPromptValue(messages=history))
+    assert first.new_messages == history
+
+    second = session.delta(
+        ChatPromptValue(messages=history + [AIMessage(content="Hello!")])
+    )
+    assert second.start == 2
+    assert second.continues_session
+    assert second.new_messages == [AIMessage(content="Hello!")]
+
+
+def test_message_instances_reused() -> None:
+    """Test that equal messages from the previous prompt are reused."""
+    session = ChatSession()
+    first = session.delta(ChatPromptValue(messages=[HumanMessage(content="Hi")]))
+    second = session.delta(
+        ChatPromptValue(
+            messages=[HumanMessage(content="Hi"), HumanMessage(content="Bye")]
+        )
+    )
+    assert second.to_messages()[0] is first.to_messages()[0]
+
+
+def test_changed_history() -> None:
+    """Test that a change in earlier messages is flagged."""
+    session = ChatSession()
+    session.delta(
+        ChatPromptValue(messages=[HumanMessage(content="A"), HumanMessage(content="B")])
+    )
+    changed = session.delta(
+        ChatPromptValue(messages=[HumanMessage(content="A"), HumanMessage(content="C")])
+    )
+    assert not changed.continues_session
+    assert changed.new_messages == [HumanMessage(content="C")]
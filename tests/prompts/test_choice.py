@@ -1,5 +1,9 @@
 """Tests for choice prompting."""
 
+import pickle
+from typing import List
+
+from langchain.prompts.base import StringPromptValue
 from langchain.prompts.chat import (
     HumanMessagePromptTemplate,
     SystemMessagePromptTemplate,
@@ -8,7 +12,11 @@ from langchain.schema import HumanMessage, SystemMessage
 
 from langchain_contrib.prompts import ChoicePromptTemplate
 from langchain_contrib.prompts.choice import (
+    BaseChoicePrompt,
+    BM25ChoiceRetriever,
+    ChatChoicePrompt,
     ChoiceStr,
+    StringChoicePrompt,
     get_oxford_comma_formatter,
     get_simple_joiner,
     list_of_choices,
@@ -196,3 +204,147 @@ def test_custom_key() -> None:
         "Your task is to take over the world. You have access to Google and a "
         "Bash terminal. Begin."
     )
+
+
+class CountingPromptValue(StringPromptValue):
+    """String prompt value that keeps track of how often it gets rendered."""
+
+    renders: List[int] = []
+
+    def to_string(self) -> str:
+        """Count this render."""
+        self.renders.append(1)
+        return super().to_string()
+
+
+def test_lazy_string_choice_prompt() -> None:
+    """Test that string choice prompts only render their prompt once, on demand."""
+    prompt = CountingPromptValue(text="Pick one", renders=[])
+    choice_prompt = BaseChoicePrompt.from_prompt(prompt, choices=["a", "b"])
+    assert isinstance(choice_prompt, StringChoicePrompt)
+    assert prompt.renders == []
+
+    rendered = choice_prompt.to_string()
+    assert isinstance(rendered, ChoiceStr)
+    assert rendered.choices == ["a", "b"]
+    assert choice_prompt.text == "Pick one"
+    assert choice_prompt.to_string() is rendered
+    assert len(prompt.renders) == 1
+
+
+def test_lazy_chat_choice_prompt() -> None:
+    """Test that chat choice prompts expose their messages lazily."""
+    template = ChoicePromptTemplate.from_messages(
+        messages=[HumanMessagePromptTemplate.from_template("Pick {choices}.")],
+    )
+    prompt = template.format_prompt(choices=["red", "blue"])
+    assert isinstance(prompt, ChatChoicePrompt)
+    assert prompt.messages == [HumanMessage(content="Pick red or blue.")]
+    assert prompt.to_string() == "Human: Pick red or blue."
+
+
+def test_lazy_choice_prompt_consistent() -> None:
+    """Test that lazily rendered fields don't depend on what was accessed so far."""
+    first = BaseChoicePrompt.from_prompt(
+        StringPromptValue(text="Pick a or b"), choices=["a", "b"]
+    )
+    second = BaseChoicePrompt.from_prompt(
+        StringPromptValue(text="Pick a or b"), choices=["a", "b"]
+    )
+    assert isinstance(first, StringChoicePrompt)
+    assert first.text == "Pick a or b"
+    assert first == second
+    assert second.dict()["text"] == "Pick a or b"
+    assert "text='Pick a or b'" in repr(second)
+    assert pickle.loads(pickle.dumps(first)) == first
+
+    copied = first.copy(update={"prompt": StringPromptValue(text="other")})
+    assert isinstance(copied, StringChoicePrompt)
+    assert copied.to_string() == "other"
+    assert copied.text == "other"
+    assert first.to_string() == "Pick a or b"
+
+
+def test_batch_formatting() -> None:
+    """Test formatting a batch of choice prompts."""
+    template = ChoicePromptTemplate.from_template(
+        "This {product} is available in {choices}.",
+    ).permissive_partial(choices=["red", "green"])
+    prompts = template.format_prompts([{"product": "dress"}, {"product": "car"}])
+    assert [p.to_string() for p in prompts] == [
+        "This dress is available in red or green.",
+        "This car is available in red or green.",
+    ]
+    assert all(isinstance(p, StringChoicePrompt) for p in prompts)
+    assert isinstance(prompts[1], StringChoicePrompt)
+    assert prompts[1].choices == ["red", "green"]
+
+
+def test_serialization_cached() -> None:
+    """Test that formatting the same choices again doesn't reserialize them."""
+    serialized: List[str] = []
+
+    def serializer(choice: str) -> str:
+        serialized.append(choice)
+        return choice
+
+    colors = ["red", "green"]
+    template = ChoicePromptTemplate.from_template(
+        "Pick from {choices}.", choice_serializer=serializer
+    )
+    assert template.format(choices=colors) == "Pick from red or green."
+    assert template.format(choices=colors) == "Pick from red or green."
+    assert serialized == ["red", "green"]
+
+    colors.append("blue")
+    assert template.format(choices=colors) == "Pick from red, green, or blue."
+    template.choices_formatter = get_simple_joiner()
+    assert template.format(choices=colors) == "Pick from red, green, blue."
+
+
+def test_serialization_cache_not_stale() -> None:
+    """Test that cached serializations can't be changed or go out of date."""
+    colors = ["red", "green"]
+    template = ChoicePromptTemplate.from_template("Pick from {choices}.")
+    prompt = template.format_prompt(choices=colors)
+    assert isinstance(prompt, BaseChoicePrompt)
+    prompt.choices.append("blue")
+    later = template.format_prompt(choices=colors)
+    assert isinstance(later, BaseChoicePrompt)
+    assert later.choices == ["red", "green"]
+
+    colors[1] = "blue"
+    assert template.format(choices=colors) == "Pick from red or blue."
+
+
+def test_choice_retrieval() -> None:
+    """Test that only the choices most relevant to the input are shown."""
+    tools = [
+        "Calculator: do arithmetic",
+        "Search: look up current events on the web",
+        "Terminal: run bash commands",
+        "Weather: look up the weather forecast",
+    ]
+    template = ChoicePromptTemplate.from_template(
+        "Q: {input}\nTools:\n{choices}",
+        choices_formatter=list_of_choices,
+        choice_retriever=BM25ChoiceRetriever(k=2),
+    )
+    prompt = template.format_prompt(
+        input="What is the weather forecast?", choices=tools
+    )
+    assert isinstance(prompt, BaseChoicePrompt)
+    assert prompt.choices == [
+        "Search: look up current events on the web",
+        "Weather: look up the weather forecast",
+    ]
+    assert prompt.to_string().endswith("2. Weather: look up the weather forecast")
+
+
+def test_choice_retrieval_fills_up() -> None:
+    """Test that unmatched queries still get k choices."""
+    retriever = BM25ChoiceRetriever(k=2)
+    choices = ["red", "green", "blue"]
+    assert retriever.shortlist(choices, "purple") == ["red", "green"]
+    assert retriever.shortlist(choices, "blue") == ["red", "blue"]
+    assert retriever.shortlist(choices, "blue") is retriever.shortlist(choices, "blue")
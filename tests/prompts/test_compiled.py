@@ -0,0 +1,47 @@
+"""Tests for compiled templates."""
+
+import pytest
+
+from langchain_contrib.prompts import ZPromptTemplate
+from langchain_contrib.prompts.compiled import (
+    CompiledFString,
+    FallbackTemplate,
+    compile_template,
+)
+
+
+def test_compiled_segments() -> None:
+    """Test that f-strings get split into literal and variable segments."""
+    compiled = compile_template("a={a} {{b}} c={c!r:>5}", "f-string")
+    assert isinstance(compiled, CompiledFString)
+    assert compiled.variables == {"a", "c"}
+    assert compiled.format({"a": 1, "c": "x"}) == "a=1 {b} c=  'x'"
+
+
+def test_compilation_is_cached() -> None:
+    """Test that the same template text only gets compiled once."""
+    assert compile_template("{foo}", "f-string") is compile_template(
+        "{foo}", "f-string"
+    )
+
+
+def test_compiled_strictness() -> None:
+    """Test that compiled templates complain about missing and extra arguments."""
+    compiled = compile_template("a={a}", "f-string")
+    with pytest.raises(KeyError):
+        compiled.format({})
+    with pytest.raises(KeyError):
+        compiled.format({"a": 1, "b": 2})
+
+
+def test_fallback() -> None:
+    """Test that complex replacement fields fall back to the regular formatter."""
+    compiled = compile_template("{a[0]} {b:{width}}", "f-string")
+    assert isinstance(compiled, FallbackTemplate)
+    assert compiled.format({"a": ["x"], "b": "y", "width": 3}) == "x y  "
+
+
+def test_z_prompt_template() -> None:
+    """Test that ZPromptTemplate formats through its compiled template."""
+    template = ZPromptTemplate.from_template("Hello {name}, meet {other}.")
+    assert template.format(name="Alice", other="Bob") == "Hello Alice, meet Bob."
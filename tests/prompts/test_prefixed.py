@@ -41,3 +41,21 @@ def test_chat_prefix() -> None:
             ]
         ).to_messages()
     )
+
+
+def test_string_prefix_reuse() -> None:
+    """Test that the same string prefix reuses previously built templates."""
+    get_terminal_prompt_template = PrefixedTemplate("Enter in the {shell} command: ")
+    first = get_terminal_prompt_template(prefix="Your task is to {task}.", joiner=" ")
+    second = get_terminal_prompt_template(prefix="Your task is to {task}.", joiner=" ")
+    assert first is not second
+    assert first.subprompts[0] is second.subprompts[0]  # type: ignore
+    assert second.format(task="ls", shell="bash") == (
+        "Your task is to ls. Enter in the bash command: "
+    )
+
+    first.input_variables.append("extra")
+    first.subprompts.append(first.subprompts[0])  # type: ignore
+    third = get_terminal_prompt_template(prefix="Your task is to {task}.", joiner=" ")
+    assert "extra" not in third.input_variables
+    assert len(third.subprompts) == 2  # type: ignore
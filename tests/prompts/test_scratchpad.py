@@ -0,0 +1,61 @@
+"""Tests for the append-only scratchpad prompt value."""
+
+from langchain.schema import HumanMessage
+
+from langchain_contrib.prompts import ScratchpadPromptValue
+
+
+def test_append_to_string() -> None:
+    """Test that appended steps show up in the rendered scratchpad."""
+    scratchpad = ScratchpadPromptValue(joiner="\n").append("one").append("two")
+    assert scratchpad.to_string() == "one\ntwo"
+    assert scratchpad.append("three").to_string() == "one\ntwo\nthree"
+
+
+def test_append_is_immutable() -> None:
+    """Test that appending leaves the original scratchpad untouched."""
+    first = ScratchpadPromptValue(steps=["one"])
+    second = first.append(" two")
+    assert first.to_string() == "one"
+    assert second.to_string() == "one two"
+    assert first.steps == ["one"]
+
+
+def test_branching() -> None:
+    """Test that appending twice to the same scratchpad creates separate branches."""
+    base = ScratchpadPromptValue(joiner=" ", steps=["I"])
+    base.to_string()
+    left = base.append("went left")
+    right = base.append("went right")
+    assert left.to_string() == "I went left"
+    assert right.to_string() == "I went right"
+    assert left.append("again").to_string() == "I went left again"
+
+
+def test_empty() -> None:
+    """Test that an empty scratchpad renders as an empty string."""
+    scratchpad = ScratchpadPromptValue()
+    assert scratchpad.to_string() == ""
+    assert scratchpad.to_messages() == []
+
+
+def test_messages_are_reused() -> None:
+    """Test that each step becomes its own message, created only once."""
+    first = ScratchpadPromptValue().append("one")
+    first_messages = first.to_messages()
+    second_messages = first.append("two").to_messages()
+    assert second_messages == [
+        HumanMessage(content="one"),
+        HumanMessage(content="two"),
+    ]
+    assert second_messages[0] is first_messages[0]
+
+
+def test_steps_in_equality_and_repr() -> None:
+    """Test that scratchpads are compared and shown by their steps too."""
+    assert ScratchpadPromptValue(steps=["a"]) != ScratchpadPromptValue(steps=["b"])
+    assert ScratchpadPromptValue(steps=["a"]) == ScratchpadPromptValue().append("a")
+    assert ScratchpadPromptValue(steps=["a"]).dict() == {"joiner": "", "steps": ["a"]}
+    assert repr(ScratchpadPromptValue(steps=["a"])) == (
+        "ScratchpadPromptValue(joiner='', steps=['a'])"
+    )
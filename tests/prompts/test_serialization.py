@@ -0,0 +1,77 @@
+"""Tests for saving and loading composite prompt templates."""
+
+import pickle
+from pathlib import Path
+
+import pytest
+from langchain.prompts.chat import HumanMessagePromptTemplate
+from langchain.schema import SystemMessage
+
+from langchain_contrib.prompts import (
+    ChainedPromptTemplate,
+    ChoicePromptTemplate,
+    DefaultsTo,
+    ZChatPromptTemplate,
+    ZPromptTemplate,
+    deserialize_template,
+    load_template,
+    save_template,
+    serialize_template,
+)
+from langchain_contrib.prompts.choice import BM25ChoiceRetriever, list_of_choices
+
+
+def test_choice_round_trip() -> None:
+    """Check that a choice template formats the same after a round trip."""
+    template = ChoicePromptTemplate.from_template(
+        "Pick one of {choices} for {input}",
+        choices_formatter=list_of_choices,
+        choice_retriever=BM25ChoiceRetriever(k=2),
+    ).permissive_partial(choices=["apple pie", "apple juice", "banana"])
+    loaded = deserialize_template(serialize_template(template))
+    assert isinstance(loaded, ChoicePromptTemplate)
+    assert loaded.format(input="apple") == template.format(input="apple")
+
+
+def test_chained_file_round_trip(tmp_path: Path) -> None:
+    """Check that nested templates survive being saved to a file."""
+    template = ChainedPromptTemplate(
+        [
+            ZPromptTemplate.from_template("Hi {name}."),
+            ZPromptTemplate.from_template("Bye {nickname}."),
+        ],
+        joiner=" ",
+    ).permissive_partial(nickname=DefaultsTo("name"))
+    path = tmp_path / "template.json"
+    save_template(template, path)
+    loaded = load_template(path)
+    assert loaded.format(name="Bob") == "Hi Bob. Bye Bob."
+
+
+def test_chat_round_trip() -> None:
+    """Check that chat templates keep their messages after a round trip."""
+    template = ZChatPromptTemplate.from_messages(
+        [
+            SystemMessage(content="Be nice."),
+            HumanMessagePromptTemplate.from_template("{input}"),
+        ]
+    )
+    loaded = deserialize_template(serialize_template(template))
+    assert loaded.format_prompt(input="Hi").to_messages() == (
+        template.format_prompt(input="Hi").to_messages()
+    )
+
+
+def test_unserializable_value() -> None:
+    """Check that the error points to where the offending value is."""
+    template = ZPromptTemplate.from_template("{a}").permissive_partial(a=object())
+    with pytest.raises(ValueError, match="permissive_partial_variables.a"):
+        serialize_template(template)
+
+
+def test_pickle_round_trip() -> None:
+    """Check that templates can be pickled even after caches are populated."""
+    template = ChainedPromptTemplate(["Hi {name}.", "Bye."], joiner=" ")
+    template.format(name="Bob")
+    loaded = pickle.loads(pickle.dumps(template))
+    assert loaded.format(name="Alice") == "Hi Alice. Bye."
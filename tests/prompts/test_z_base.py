@@ -1,7 +1,9 @@
 """Tests for ZBasePromptTemplate."""
 
+import asyncio
 from typing import Any, List
 
+import pytest
 from langchain.prompts import PromptTemplate
 from langchain.prompts.base import StringPromptValue
 from langchain.prompts.chat import ChatPromptValue, SystemMessagePromptTemplate
@@ -13,6 +15,8 @@ from langchain_contrib.prompts import (
     ZBasePromptTemplate,
     ZChatPromptTemplate,
     ZPromptTemplate,
+    interned_template,
+    z_base,
 )
 
 
@@ -114,3 +118,148 @@ def test_chat_partials() -> None:
     assert partial.format_prompt(c=[3]) == ChatPromptValue(
         messages=[SystemMessage(content="a=one b=2 c=[3]")]
     )
+
+
+def test_partials_share_structure() -> None:
+    """Check that partials layer on top of each other without copying the template."""
+    base = PromptTemplate.from_template("a={a} b={b} c={c}")
+    z_base = ZBasePromptTemplate.from_base_template(base)
+    first = z_base.permissive_partial(a="one", b="two")
+    second = first.permissive_partial(b=2)
+    assert second.base_template is first.base_template
+    assert second.input_variables == ["c"]
+    assert first.input_variables == ["c"]
+    assert z_base.input_variables == ["a", "b", "c"]
+    assert second.format(c=[3]) == "a=one b=2 c=[3]"
+    assert first.format(c=[3]) == "a=one b=two c=[3]"
+
+
+def test_default_redirect_chain() -> None:
+    """Check that redirections to other redirections get followed."""
+    z_base = ZPromptTemplate.from_template("{a} {b} {c}")
+    partial = z_base.permissive_partial(a=DefaultsTo("b"), b=DefaultsTo("c"))
+    assert partial.format(c="x") == "x x x"
+    assert partial.format(b="y", c="x") == "y y x"
+
+
+def test_default_redirect_cycle() -> None:
+    """Check that cyclical redirections are caught when the partial is created."""
+    z_base = ZPromptTemplate.from_template("{a} {b} {c}")
+    with pytest.raises(ValueError):
+        z_base.permissive_partial(a=DefaultsTo("b"), b=DefaultsTo("a"))
+
+
+def test_memoized_partial_fn() -> None:
+    """Check that callable partials can be evaluated only once."""
+    calls: List[int] = []
+
+    def _partial_fn() -> int:
+        calls.append(1)
+        return len(calls)
+
+    z_base = ZPromptTemplate.from_template("result={result}", memoize_partials=True)
+    partial = z_base.permissive_partial(result=_partial_fn)
+    assert partial.format() == "result=1"
+    assert partial.format() == "result=1"
+    assert len(calls) == 1
+
+    unmemoized = ZPromptTemplate.from_template("result={result}")
+    partial = unmemoized.permissive_partial(result=_partial_fn)
+    assert partial.format() == "result=2"
+    assert partial.format() == "result=3"
+
+
+def test_interned_template() -> None:
+    """Check that template strings are only parsed once, but never shared."""
+    first = interned_template("Hello {name}")
+    second = interned_template("Hello {name}")
+    assert first is not second
+    assert first.template == second.template
+    assert second.format(name="world") == "Hello world"
+
+    first.input_variables.append("extra")
+    first.partial_variables["name"] = "partial"  # type: ignore
+    third = interned_template("Hello {name}")
+    assert third.input_variables == ["name"]
+    assert third.partial_variables == {}
+
+
+async def test_async_partials_concurrent() -> None:
+    """Test that independent async partials get awaited concurrently."""
+    started = []
+
+    async def fetch(name: str) -> str:
+        started.append(name)
+        await asyncio.sleep(0)
+        # both fetches should have started before either one finishes
+        assert len(started) == 2
+        return name
+
+    template = ZPromptTemplate.from_template("{a} {b} {c}").permissive_partial(
+        a=lambda: fetch("date"), b=lambda: fetch("status"), c=DefaultsTo("a")
+    )
+    result = await template.aformat_prompt()
+    assert result.to_string() == "date status date"
+
+
+async def test_async_nested_partials() -> None:
+    """Test that async partials of nested templates get awaited too."""
+
+    async def today() -> str:
+        return "Monday"
+
+    inner = ZPromptTemplate.from_template("{day}, {name}").permissive_partial(day=today)
+    template = ChainedPromptTemplate(["Hi.", inner], joiner=" ")
+    result = await template.aformat_prompt(name="Bob")
+    assert result.to_string() == "Hi. Monday, Bob"
+
+
+def test_sync_format_async_partial() -> None:
+    """Test that async partials are rejected when formatting synchronously."""
+
+    async def today() -> str:
+        return "Monday"
+
+    template = ZPromptTemplate.from_template("{day}").permissive_partial(day=today)
+    with pytest.raises(TypeError, match="aformat_prompt"):
+        template.format()
+
+
+def test_template_checked_on_format() -> None:
+    """Test that invalid templates are only caught once they get formatted."""
+    template = ZPromptTemplate(template="{a} {b}", input_variables=["a"])
+    with pytest.raises(ValueError):
+        template.format(a=1)
+
+    valid = ZPromptTemplate(template="{a}", input_variables=["a"])
+    assert valid.format(a=1) == "1"
+    with pytest.raises(ValueError):
+        valid.copy(update={"template": "{a} {b}"}).format(a=1)
+
+
+def test_template_check_memoized(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the same template text isn't checked again for derived templates."""
+    checked: List[str] = []
+    monkeypatch.setattr(
+        z_base,
+        "check_valid_template",
+        lambda template, *args: checked.append(template),
+    )
+    template = ZPromptTemplate.from_template("{unique_a} {unique_b}")
+    assert checked == []
+    template.format(unique_a=1, unique_b=2)
+    template.partial(unique_a="1").format(unique_b=2)
+    ZPromptTemplate.from_template("{unique_a} {unique_b}").format(
+        unique_a=1, unique_b=2
+    )
+    assert checked == ["{unique_a} {unique_b}"]
+
+
+def test_formatted_values_are_pydantic() -> None:
+    """Test that formatted values work like the pydantic values they claim to be."""
+    value = ZPromptTemplate.from_template("{x}").format_prompt(x=1)
+    assert type(value) is StringPromptValue
+    assert value == StringPromptValue(text="1")
+    assert value.dict() == {"text": "1"}
+    assert value.json() == '{"text": "1"}'
+    assert value.copy() == value
@@ -0,0 +1,14 @@
+"""Test the bounded cache."""
+
+from langchain_contrib.utils import BoundedCache
+
+
+def test_bounded_cache() -> None:
+    """Test that the cache forgets everything once it's full."""
+    cache: BoundedCache[str, int] = BoundedCache(2)
+    assert cache.put("a", 1) == 1
+    cache.put("b", 2)
+    cache.put("b", 3)
+    assert cache == {"a": 1, "b": 3}
+    cache.put("c", 4)
+    assert cache == {"c": 4}
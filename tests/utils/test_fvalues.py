@@ -2,7 +2,7 @@
 
 from fvalues import F, FValue
 
-from langchain_contrib.utils.fvalues import f_join
+from langchain_contrib.utils.fvalues import FRope, f_join
 
 
 def test_f_join_empty() -> None:
@@ -49,3 +49,29 @@ def test_f_join_empty_string() -> None:
         FValue(source="b", value=2, formatted="2"),
         "c",
     )
+
+
+def test_f_join_preserves_f_parts() -> None:
+    """Test that F-strings are kept as single parts."""
+    b = 2
+    f = F(f"b={b}")
+    s = f_join(" ", ["a", f, "c"])
+    assert s.parts == ("a", " ", f, " ", "c")
+
+
+def test_rope_nesting() -> None:
+    """Test that nested ropes are spliced in when materialized."""
+    inner = FRope(", ", ["red", "green"])
+    outer = FRope(", or ", [inner, "blue"])
+    assert str(outer) == "red, green, or blue"
+    assert outer.parts == ("red", ", ", "green", ", or ", "blue")
+    assert outer.to_f() is outer.to_f()
+    assert f_join(" ", [outer, "!"]) == "red, green, or blue !"
+
+
+def test_rope_deep_nesting() -> None:
+    """Test that deeply nested ropes don't hit the recursion limit."""
+    rope = FRope("", ["a"])
+    for _ in range(5000):
+        rope = FRope("", [rope, "a"])
+    assert str(rope) == "a" * 5001
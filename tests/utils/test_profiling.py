@@ -0,0 +1,52 @@
+"""Tests for the prompt profiler."""
+
+import json
+
+from langchain_contrib.prompts import ChainedPromptTemplate, ChoicePromptTemplate
+from langchain_contrib.utils import PromptProfiler, f_join
+
+
+def test_nested_call_tree() -> None:
+    """Test that nested template calls show up as a tree."""
+    template = ChainedPromptTemplate(
+        [
+            "Choose:",
+            ChoicePromptTemplate.from_template("{choices}").permissive_partial(
+                choices=["a", "b"]
+            ),
+        ],
+        joiner=" ",
+    )
+    with PromptProfiler(trace_memory=True) as profiler:
+        assert template.format() == "Choose: a or b"
+
+    assert [call.name for call in profiler.calls] == [
+        "ChainedPromptTemplate.format_prompt",
+        "ChainedPromptValue.to_string",
+    ]
+    tree = json.loads(profiler.to_json())
+    text_call, choice_call = tree["children"][0]["children"]
+    assert text_call["name"] == "ZPromptTemplate.format_prompt"
+    assert choice_call["name"] == "ChoicePromptTemplate.format_prompt"
+    assert [c["name"] for c in choice_call["children"]] == [
+        "ChoicePromptTemplate.serialize_choices",
+        "ZPromptTemplate.format_prompt",
+        "BaseChoicePrompt.from_prompt",
+    ]
+
+
+def test_collapsed_stacks() -> None:
+    """Test the flame graph format."""
+    with PromptProfiler() as profiler:
+        f_join(" ", ["a", "b"])
+    [line] = profiler.to_collapsed().splitlines()
+    stack, microseconds = line.split(" ")
+    assert stack == "f_join"
+    assert int(microseconds) >= 0
+
+
+def test_disabled_by_default() -> None:
+    """Test that nothing gets recorded outside of the profiler context."""
+    profiler = PromptProfiler()
+    f_join(" ", ["a", "b"])
+    assert profiler.calls == []